@@ -0,0 +1,252 @@
+import io
+import wave
+import threading
+import av
+import discord
+import numpy as np
+from config import *
+
+
+# Discord voice audio: 48 kHz, stereo, signed 16-bit PCM, 20 ms per packet
+SAMPLE_RATE = 48000
+CHANNELS = 2
+SAMPLE_WIDTH = 2
+BYTES_PER_SECOND = SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH
+FRAME_BYTES = BYTES_PER_SECOND // 50
+
+
+def frame_rms(pcm):
+    """
+    Calculates the RMS energy of a PCM frame.
+
+    Args:
+        pcm: Signed 16-bit PCM bytes.
+
+    Returns:
+        The RMS value on the int16 scale.
+    """
+    samples = np.frombuffer(pcm, dtype=np.int16, count=len(pcm) // SAMPLE_WIDTH)
+    if samples.size == 0:
+        return 0.0
+    samples = samples.astype(np.float32)
+    return float(np.sqrt(np.dot(samples, samples) / samples.size))
+
+
+def is_speech_frame(pcm, threshold=None):
+    """
+    Tells speech packets apart from silent or noise-only packets.
+    Only the last 20 ms frame is checked, because the receiver prepends
+    zero padding for gaps between packets.
+
+    Args:
+        pcm: Signed 16-bit PCM bytes of one received packet.
+        threshold: RMS threshold, SPEECH_RMS_THRESHOLD by default.
+
+    Returns:
+        True if the frame energy is above the threshold.
+    """
+    return frame_rms(pcm[-FRAME_BYTES:]) >= (threshold or SPEECH_RMS_THRESHOLD)
+
+
+class PCMBuffer:
+    """
+    Fixed-capacity utterance buffer. The memory is allocated once and reused
+    through a PCMBufferPool, and the audio is handed on as a memoryview, not copied.
+    """
+
+    def __init__(self, capacity, pool=None):
+        self.data = bytearray(capacity)
+        self.capacity = capacity
+        self.length = 0
+        self.pool = pool
+
+    def __len__(self):
+        return self.length
+
+    def free(self):
+        """
+        Returns the number of bytes that still fit into the buffer.
+        """
+        return self.capacity - self.length
+
+    def append(self, pcm):
+        """
+        Copies as much of pcm as fits into the buffer.
+
+        Args:
+            pcm: PCM bytes, bytearray or memoryview.
+
+        Returns:
+            The number of bytes written.
+        """
+        count = min(len(pcm), self.capacity - self.length)
+        self.data[self.length:self.length + count] = memoryview(pcm)[:count]
+        self.length += count
+        return count
+
+    def view(self):
+        """
+        Returns a zero-copy view of the buffered audio. The view is only valid
+        until the buffer is released.
+        """
+        return memoryview(self.data)[:self.length]
+
+    def release(self):
+        """
+        Returns the buffer to its pool for reuse.
+        """
+        self.length = 0
+        if self.pool:
+            self.pool.release(self)
+
+
+class PCMBufferPool:
+    """
+    Pool of preallocated PCMBuffers of MAX_UTTERANCE_SECONDS each, shared by all sinks.
+    Up to max_free released buffers are kept for reuse, the rest are freed.
+    """
+
+    def __init__(self, seconds=None, max_free=None):
+        self.capacity = int((seconds or MAX_UTTERANCE_SECONDS) * BYTES_PER_SECOND) // FRAME_BYTES * FRAME_BYTES
+        self.max_free = max_free if max_free is not None else AUDIO_BUFFER_POOL_SIZE
+        self.free_buffers = []
+        self.lock = threading.Lock()
+        self.allocated = 0
+
+    def acquire(self):
+        """
+        Returns an empty buffer, reusing a released one if possible.
+        """
+        with self.lock:
+            if self.free_buffers:
+                return self.free_buffers.pop()
+            self.allocated += 1
+        return PCMBuffer(self.capacity, self)
+
+    def release(self, buffer):
+        with self.lock:
+            if len(self.free_buffers) < self.max_free:
+                self.free_buffers.append(buffer)
+            else:
+                self.allocated -= 1
+
+
+buffer_pool = PCMBufferPool()
+
+
+# A complete Opus packet that decodes to 20 ms of silence
+OPUS_SILENCE_FRAME = b"\xf8\xff\xfe"
+
+
+class SilenceSource(discord.AudioSource):
+    """
+    Endless silence used to keep the voice connection alive.
+    Yields a prebuilt Opus silence packet, so nothing is encoded,
+    decoded, downloaded or spawned per frame.
+    """
+
+    def read(self):
+        return OPUS_SILENCE_FRAME
+
+    def is_opus(self):
+        return True
+
+
+WHISPER_SAMPLE_RATE = 16000
+_DECIMATION = SAMPLE_RATE // WHISPER_SAMPLE_RATE
+
+
+def _lowpass_taps(num_taps=31, cutoff=7600):
+    """
+    Builds a Hann-windowed sinc low-pass filter used before decimation.
+
+    Args:
+        num_taps: Filter length (odd).
+        cutoff: Cutoff frequency in Hz.
+
+    Returns:
+        Normalized float32 filter taps.
+    """
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = np.sinc(2 * cutoff / SAMPLE_RATE * n) * np.hanning(num_taps)
+    return (taps / taps.sum()).astype(np.float32)
+
+
+_LOWPASS_TAPS = _lowpass_taps()
+
+
+def pcm_to_whisper_audio(raw_pcm):
+    """
+    Converts Discord PCM (48 kHz stereo int16) into the 16 kHz mono float32
+    array expected by faster-whisper, without any container encoding.
+
+    Args:
+        raw_pcm: Raw PCM bytes, bytearray or memoryview.
+
+    Returns:
+        A float32 NumPy array in the range [-1, 1].
+    """
+    frames = len(raw_pcm) // (CHANNELS * SAMPLE_WIDTH)
+    stereo = np.frombuffer(raw_pcm, dtype=np.int16, count=frames * CHANNELS).reshape(-1, CHANNELS)
+
+    # Downmix straight into a zero-padded buffer for the filter below
+    pad = len(_LOWPASS_TAPS) // 2
+    padded = np.zeros(frames + 2 * pad, dtype=np.float32)
+    mono = padded[pad:pad + frames]
+    np.add(stereo[:, 0], stereo[:, 1], out=mono, dtype=np.float32)
+    mono *= 1.0 / (32768.0 * CHANNELS)
+
+    # Low-pass and decimate by 3, computing only the samples that are kept
+    windows = np.lib.stride_tricks.sliding_window_view(padded, len(_LOWPASS_TAPS))[::_DECIMATION]
+    return windows @ _LOWPASS_TAPS
+
+
+def encode_for_upload(raw_pcm, upload_format=None):
+    """
+    Encodes Discord PCM as a 16 kHz mono file for remote transcription.
+    Encoding happens in-process, no ffmpeg subprocess is started.
+
+    Args:
+        raw_pcm: Raw PCM bytes (48 kHz stereo int16).
+        upload_format: "wav", "flac" or "ogg". Defaults to UPLOAD_FORMAT.
+
+    Returns:
+        A (filename, data) tuple ready to be passed as the upload file.
+    """
+    upload_format = (upload_format or UPLOAD_FORMAT).lower()
+    audio = pcm_to_whisper_audio(raw_pcm)
+    np.clip(audio, -1.0, 1.0, out=audio)
+    pcm16 = (audio * 32767).astype(np.int16)
+
+    out_buffer = io.BytesIO()
+
+    if upload_format == "wav":
+        with wave.open(out_buffer, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(WHISPER_SAMPLE_RATE)
+            wav_file.writeframes(pcm16.tobytes())
+        return "audio.wav", out_buffer.getvalue()
+
+    if upload_format == "flac":
+        codec = "flac"
+    elif upload_format == "ogg":
+        codec = "libopus"
+    else:
+        raise ValueError(f"Unsupported upload format: {upload_format}")
+
+    with av.open(out_buffer, 'w', format=upload_format) as container:
+        # Mid complexity keeps Opus encoding ~3x faster than the default at almost the same size
+        options = {'compression_level': '5'} if codec == "libopus" else {}
+        stream = container.add_stream(codec, rate=WHISPER_SAMPLE_RATE, layout='mono', options=options)
+        if codec == "libopus":
+            stream.bit_rate = UPLOAD_OPUS_BITRATE
+
+        frame = av.AudioFrame.from_ndarray(pcm16.reshape(1, -1), format='s16', layout='mono')
+        frame.sample_rate = WHISPER_SAMPLE_RATE
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+
+    return f"audio.{upload_format}", out_buffer.getvalue()
@@ -0,0 +1,93 @@
+"""
+Benchmark: local transcription throughput, one utterance at a time versus
+batched inference (transcribe_batch) at several batch sizes.
+
+Runs on the CPU by default (int8), the same setup as a host without a GPU.
+Each file in the directory is one utterance; without a directory the
+utterances are synthetic speech-like signals that bypass the VAD trimming.
+
+Usage:
+    python benchmarks/batched_stt.py [recordings/] [--model small] [--sizes 2 4 8]
+
+--model also takes the path of a converted model directory, for hosts
+without access to the Hugging Face Hub.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GUILD_ID", "0")
+
+from faster_whisper import decode_audio
+import stt
+from audio import BYTES_PER_SECOND
+
+
+def load_utterances(directory=None, count=8, seconds=4):
+    """
+    Loads recordings as Discord PCM (48 kHz stereo int16), or synthesizes count utterances.
+    """
+    if directory:
+        utterances = []
+        for name in sorted(os.listdir(directory)):
+            left, right = decode_audio(os.path.join(directory, name), sampling_rate=48000, split_stereo=True)
+            stereo = np.stack((left, right), axis=1)
+            utterances.append((np.clip(stereo, -1, 1) * 32767).astype(np.int16).tobytes())
+        return utterances
+
+    utterances = []
+    for i in range(count):
+        rng = np.random.default_rng(i)
+        t = np.arange(int(seconds * 48000)) / 48000
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+        voiced = sum(np.sin(2 * np.pi * rng.uniform(100, 220) * k * t) / k for k in range(1, 6))
+        signal = 0.2 * envelope * voiced + 0.01 * rng.standard_normal(t.size)
+        utterances.append((signal * 32767).astype(np.int16).repeat(2).tobytes())
+    return utterances
+
+
+def run(utterances, batch_size):
+    """
+    Transcribes all utterances in batches of batch_size and returns the elapsed time.
+    """
+    start = time.perf_counter()
+    for i in range(0, len(utterances), batch_size):
+        stt.transcribe_batch(utterances[i:i + batch_size])
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", nargs="?")
+    parser.add_argument("--model", default="small")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--compute-type", default="int8")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--count", type=int, default=8, help="number of synthetic utterances")
+    args = parser.parse_args()
+
+    stt.WHISPER_MODEL = args.model
+    stt.WHISPER_DEVICE = args.device
+    stt.WHISPER_COMPUTE_TYPE = args.compute_type
+    stt.load_whisper_model()
+
+    utterances = load_utterances(args.directory, args.count)
+    if not args.directory:
+        # The synthetic signals are not speech to the VAD, keep them whole
+        stt.trim_to_speech = lambda audio: audio
+    audio_seconds = sum(len(pcm) for pcm in utterances) / BYTES_PER_SECOND
+    print(f"{len(utterances)} utterances, {audio_seconds:.0f}s of audio, model '{args.model}' on {args.device}")
+    print()
+
+    # The first passes set up the model and the VAD, keep them out of the timings
+    run(utterances[:max(args.sizes)], max(args.sizes))
+
+    baseline = run(utterances, 1)
+    print(f"{'batch':>5} {'time':>8} {'utt/s':>7} {'RTF':>6} {'speedup':>8}")
+    print(f"{1:>5} {baseline:>7.2f}s {len(utterances) / baseline:>7.2f} {baseline / audio_seconds:>6.3f} {1.0:>7.2f}x")
+    for size in args.sizes:
+        elapsed = run(utterances, size)
+        print(f"{size:>5} {elapsed:>7.2f}s {len(utterances) / elapsed:>7.2f} {elapsed / audio_seconds:>6.3f} {baseline / elapsed:>7.2f}x")
@@ -0,0 +1,372 @@
+"""
+Offline end-to-end benchmark: replays PCM packet streams of several concurrent
+speakers into AutoCutSink.write with real 20 ms packet timing, and runs the whole
+pipeline (endpointing, scheduler, STT, LLM, tools, TTS, playback) against local
+stand-ins for Discord, Groq, Tavily and edge-tts with configurable latency.
+
+Reports throughput, per-stage and end-to-end latency percentiles and memory use.
+No network or API keys are needed. Audio encoding, sentence splitting, history
+compaction and the scheduler run for real.
+
+Usage:
+    python benchmarks/e2e_replay.py [--guilds 2] [--speakers 3] [--utterances 4]
+    python benchmarks/e2e_replay.py --recordings recordings/ --stt-latency 0.4
+    python benchmarks/e2e_replay.py --local --local-rtf 0.2
+"""
+import os
+import sys
+import time
+import heapq
+import random
+import asyncio
+import argparse
+import resource
+import threading
+import tracemalloc
+from types import SimpleNamespace
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GUILD_ID", "0")
+os.environ.setdefault("GROQ_API_KEY", "offline")
+os.environ.setdefault("TAVILY_API_KEY", "offline")
+
+import discord
+import main
+import tools
+from config import *
+from stt import TranscriptionBatcher
+from audio import FRAME_BYTES, BYTES_PER_SECOND, buffer_pool
+from session import get_session
+from metrics import histograms, render_table
+
+
+FRAME_SECONDS = 0.02
+
+
+class Latency:
+    """
+    Base latency of a stand-in with uniform jitter around it.
+    """
+
+    def __init__(self, rng, jitter):
+        self.rng = rng
+        self.jitter = jitter
+
+    def __call__(self, base):
+        return max(0.0, base * self.rng.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+class FakeTranscriptions:
+    def __init__(self, args, latency):
+        self.args = args
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, file, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency(self.args.stt_latency))
+        return SimpleNamespace(text=f"{TRIGGERS[0].capitalize()}, what is the weather in Warsaw, question {self.calls}?")
+
+
+class FakeCompletions:
+    """
+    Streams chat completions token by token. With tool_choice="auto" a share
+    of the responses is a web_search tool call instead of text.
+    """
+
+    def __init__(self, args, latency, rng):
+        self.args = args
+        self.latency = latency
+        self.rng = rng
+        self.calls = 0
+
+    async def create(self, stream=True, tool_choice=None, **kwargs):
+        self.calls += 1
+        use_tool = tool_choice == "auto" and self.rng.random() < self.args.tool_rate
+        return self._stream(use_tool, self.calls)
+
+    async def _stream(self, use_tool, call_id):
+        await asyncio.sleep(self.latency(self.args.llm_first_token))
+
+        if use_tool:
+            fragment = SimpleNamespace(
+                index=0,
+                id=f"call_{call_id}",
+                function=SimpleNamespace(name="web_search", arguments='{"query": "weather in Warsaw"}')
+            )
+            yield self._chunk(tool_calls=[fragment])
+            return
+
+        sentence = "The weather in Warsaw is sunny with a light breeze and about twenty degrees."
+        for _ in range(self.args.reply_sentences):
+            for word in sentence.split():
+                yield self._chunk(content=word + " ")
+                await asyncio.sleep(self.latency(self.args.token_interval))
+
+    @staticmethod
+    def _chunk(content=None, tool_calls=None):
+        delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class FakeSource:
+    """
+    Stand-in for TTSAudioSource that "plays" for a time proportional to the text.
+    """
+
+    def __init__(self, duration):
+        self.duration = duration
+
+    def cleanup(self):
+        pass
+
+
+class FakeVoiceClient:
+    """
+    Plays sources on a timer thread and calls after() like the py-cord player thread.
+    Sources without a duration (the keep-alive silence) play until stopped.
+    """
+
+    def __init__(self, guild):
+        self.guild = guild
+        self.recording = True
+        self.timer = None
+        self.after = None
+        self.playing = False
+        self.lock = threading.Lock()
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return self.playing
+
+    def play(self, source, after=None):
+        with self.lock:
+            if self.playing:
+                raise discord.ClientException("Already playing audio.")
+            self.playing = True
+            self.after = after
+            duration = getattr(source, "duration", None)
+            if duration is not None:
+                self.timer = threading.Timer(duration, self._finish)
+                self.timer.start()
+
+    def stop(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+        self._finish()
+
+    def _finish(self):
+        with self.lock:
+            if not self.playing:
+                return
+            self.playing = False
+            self.timer = None
+            after, self.after = self.after, None
+        if after:
+            after(None)
+
+
+class FakeChannel:
+    def __init__(self, guild):
+        self.guild = guild
+        self.name = "bench"
+        self.messages = 0
+
+    def permissions_for(self, member):
+        return SimpleNamespace(send_messages=True)
+
+    async def send(self, embed=None, **kwargs):
+        self.messages += 1
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.me = None
+        self.voice_client = FakeVoiceClient(self)
+
+    def get_member(self, user_id):
+        return None
+
+
+def synthetic_utterance(seconds, seed):
+    """
+    Speech-like 48 kHz stereo int16 PCM: a voiced harmonic series with syllable envelope.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * 48000)) / 48000
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t + rng.uniform(0, np.pi))
+    pitch = rng.uniform(100, 220)
+    voiced = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+    signal = 0.2 * envelope * voiced + 0.01 * rng.standard_normal(t.size)
+    return (signal * 32767).astype(np.int16).repeat(2).tobytes()
+
+
+def load_recordings(directory):
+    """
+    Loads every file of a directory as Discord PCM (48 kHz stereo int16).
+    """
+    from faster_whisper import decode_audio
+
+    recordings = []
+    for name in sorted(os.listdir(directory)):
+        left, right = decode_audio(os.path.join(directory, name), sampling_rate=48000, split_stereo=True)
+        stereo = np.stack((left, right), axis=1)
+        recordings.append((np.clip(stereo, -1, 1) * 32767).astype(np.int16).tobytes())
+    return recordings
+
+
+def speaker_packets(user_id, utterances, start, pause):
+    """
+    Yields (send_time, user_id, frame) for one speaker. No packets are sent
+    during pauses, as Discord stops transmitting when a user is silent.
+    """
+    t = start
+    for pcm in utterances:
+        for offset in range(0, len(pcm) - FRAME_BYTES + 1, FRAME_BYTES):
+            yield t, user_id, pcm[offset:offset + FRAME_BYTES]
+            t += FRAME_SECONDS
+        t += pause
+
+
+def feed(sinks, streams, t0, stats):
+    """
+    Receive thread stand-in: writes the merged packet streams of all speakers
+    into their guild's sink at the scheduled times.
+    """
+    for send_time, user_id, frame in heapq.merge(*streams, key=lambda packet: packet[0]):
+        delay = t0 + send_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            stats["late_packets"] += delay < -FRAME_SECONDS
+        sinks[user_id].write(frame, user_id)
+        stats["packets"] += 1
+
+
+async def replay(args):
+    loop = asyncio.get_running_loop()
+    rng = random.Random(args.seed)
+    latency = Latency(rng, args.jitter)
+
+    # Stand-ins for every network dependency
+    main.RUN_LOCALLY = args.local
+    main.SPECULATIVE_STT = not args.no_speculative
+    main.WAKE_WORD_CASCADE_REMOTE = args.wake_word_cascade
+    main.LOGGING = False
+    main.groq_client = SimpleNamespace(
+        audio=SimpleNamespace(transcriptions=FakeTranscriptions(args, latency)),
+        chat=SimpleNamespace(completions=FakeCompletions(args, latency, rng))
+    )
+
+    async def fake_tavily(query, **params):
+        await asyncio.sleep(latency(args.tavily_latency))
+        return {"query": query, "results": [{"title": "Weather", "content": "Sunny, 20 degrees."}]}
+
+    async def fake_synthesize(text):
+        await asyncio.sleep(latency(args.tts_latency))
+        return FakeSource(len(text.split()) * args.seconds_per_word)
+
+    def fake_wake_word(raw_pcm):
+        time.sleep(latency(args.wake_word_latency))
+        return True, TRIGGERS[0]
+
+    async def fake_local_stt(raw_pcms):
+        # Local model stand-in: fixed overhead plus time proportional to the audio length
+        seconds = sum(len(raw_pcm) for raw_pcm in raw_pcms) / BYTES_PER_SECOND
+        await asyncio.sleep(latency(args.stt_latency) + seconds * args.local_rtf)
+        return [f"{TRIGGERS[0].capitalize()}, what is the weather in Warsaw?" for _ in raw_pcms]
+
+    tools.tavily_search = fake_tavily
+    main.stt_batcher = TranscriptionBatcher(fake_local_stt)
+    main.synthesize = fake_synthesize
+    main.detect_wake_word = fake_wake_word
+
+    recordings = load_recordings(args.recordings) if args.recordings else None
+    sinks = {}
+    streams = []
+    user_id = 1000
+    for g in range(args.guilds):
+        guild = FakeGuild(g + 1)
+        session = get_session(guild.id)
+        session.sink = main.make_sink(session, FakeChannel(guild))
+        main.play_keep_alive(guild.voice_client)
+
+        for s in range(args.speakers):
+            user_id += 1
+            if s == 0:
+                session.controller_id = user_id
+            if recordings:
+                utterances = [recordings[(user_id + i) % len(recordings)] for i in range(args.utterances)]
+            else:
+                utterances = [synthetic_utterance(args.utterance_seconds, user_id * 100 + i) for i in range(args.utterances)]
+            sinks[user_id] = session.sink
+            streams.append(speaker_packets(user_id, utterances, s * args.stagger, args.pause))
+
+    stats = {"packets": 0, "late_packets": 0}
+    t0 = time.monotonic() + 0.1
+    start = time.perf_counter()
+
+    feeder = threading.Thread(target=feed, args=(sinks, streams, t0, stats), daemon=True)
+    feeder.start()
+    await loop.run_in_executor(None, feeder.join)
+
+    # Let the last endpoints fire, then wait until every utterance was answered
+    await asyncio.sleep(SILENCE_THRESHOLD + 0.2)
+    while main.scheduler.queues or main.scheduler.running or main.scheduler.replies:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    audio_seconds = stats["packets"] * FRAME_SECONDS
+    return stats, audio_seconds, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=2)
+    parser.add_argument("--speakers", type=int, default=3, help="speakers per guild")
+    parser.add_argument("--utterances", type=int, default=3, help="utterances per speaker")
+    parser.add_argument("--utterance-seconds", type=float, default=3.0)
+    parser.add_argument("--pause", type=float, default=6.0, help="silence between utterances of a speaker")
+    parser.add_argument("--stagger", type=float, default=0.7, help="start offset between speakers of a guild")
+    parser.add_argument("--recordings", help="directory of recordings to replay instead of synthetic speech")
+    parser.add_argument("--local", action="store_true", help="use the local STT path (with a stand-in model)")
+    parser.add_argument("--stt-latency", type=float, default=0.35)
+    parser.add_argument("--no-speculative", action="store_true", help="disable speculative transcription on the local path")
+    parser.add_argument("--local-rtf", type=float, default=0.1, help="local stand-in seconds per second of audio")
+    parser.add_argument("--wake-word-cascade", action="store_true", help="use the wake-word cascade on the Groq path too")
+    parser.add_argument("--wake-word-latency", type=float, default=0.15)
+    parser.add_argument("--llm-first-token", type=float, default=0.3)
+    parser.add_argument("--token-interval", type=float, default=0.01)
+    parser.add_argument("--reply-sentences", type=int, default=2)
+    parser.add_argument("--tool-rate", type=float, default=0.3, help="share of answers that call web_search")
+    parser.add_argument("--tavily-latency", type=float, default=0.8)
+    parser.add_argument("--tts-latency", type=float, default=0.25)
+    parser.add_argument("--seconds-per-word", type=float, default=0.05, help="simulated playback length")
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="also report the Python heap peak (slower)")
+    args = parser.parse_args()
+
+    if args.trace_memory:
+        tracemalloc.start()
+
+    stats, audio_seconds, elapsed = main.bot.loop.run_until_complete(replay(args))
+    scheduler_stats = main.scheduler.stats()
+    answered = histograms["total"].count if "total" in histograms else 0
+
+    print()
+    print(render_table())
+    print()
+    print(f"Packets: {stats['packets']} ({audio_seconds:.0f}s of audio), late by >20 ms: {stats['late_packets']}")
+    print(f"Utterances: {scheduler_stats['processed']} processed, {scheduler_stats['merged']} merged, {scheduler_stats['dropped']} dropped")
+    print(f"Throughput: {answered / elapsed:.2f} utterances/s over {elapsed:.1f}s")
+    print(f"Audio buffers: {buffer_pool.allocated} allocated ({buffer_pool.allocated * buffer_pool.capacity / 1e6:.0f} MB)")
+    print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    if args.trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"Python heap: {current / 1e6:.1f} MB now, {peak / 1e6:.1f} MB peak")
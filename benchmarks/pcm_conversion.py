@@ -0,0 +1,77 @@
+"""
+Micro-benchmark: WAV round-trip vs direct NumPy conversion for local Whisper input.
+
+Usage:
+    python benchmarks/pcm_conversion.py
+"""
+import io
+import os
+import sys
+import time
+import wave
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GUILD_ID", "0")
+
+from faster_whisper import decode_audio
+from audio import BYTES_PER_SECOND, pcm_to_whisper_audio
+
+
+def make_pcm(seconds):
+    """
+    Generates speech-like 48 kHz stereo int16 PCM.
+
+    Args:
+        seconds: Length of the audio in seconds.
+
+    Returns:
+        A bytearray, the same type AutoCutSink hands on.
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * 48000)) / 48000
+    signal = 0.3 * np.sin(2 * np.pi * 220 * t) * np.sin(2 * np.pi * 3 * t) + 0.05 * rng.standard_normal(t.size)
+    return bytearray((signal * 32767).astype(np.int16).repeat(2).tobytes())
+
+
+def wav_path(raw_pcm):
+    """
+    The previous local path: wrap PCM in a WAV container and let faster-whisper decode and resample it.
+    """
+    out_buffer = io.BytesIO()
+    with wave.open(out_buffer, 'wb') as wav_file:
+        wav_file.setnchannels(2)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(48000)
+        wav_file.writeframes(raw_pcm)
+    out_buffer.seek(0)
+    return decode_audio(out_buffer, sampling_rate=16000)
+
+
+def measure(func, raw_pcm, repeats):
+    """
+    Returns the best wall time of several runs in milliseconds.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(raw_pcm)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+if __name__ == "__main__":
+    print(f"{'length':>8} {'wav + decode':>14} {'numpy':>10} {'speedup':>9} {'max diff':>10}")
+    for seconds in (5, 15, 30, 60):
+        raw_pcm = make_pcm(seconds)
+        assert len(raw_pcm) == seconds * BYTES_PER_SECOND
+
+        wav_ms = measure(wav_path, raw_pcm, 5)
+        numpy_ms = measure(pcm_to_whisper_audio, raw_pcm, 5)
+
+        reference = wav_path(raw_pcm)
+        converted = pcm_to_whisper_audio(raw_pcm)
+        n = min(reference.size, converted.size)
+        diff = float(np.max(np.abs(reference[:n] - converted[:n])))
+
+        print(f"{seconds:>7}s {wav_ms:>12.1f}ms {numpy_ms:>8.1f}ms {wav_ms / numpy_ms:>8.1f}x {diff:>10.4f}")
@@ -0,0 +1,106 @@
+"""
+Benchmark: payload size and STT latency of the Groq upload formats.
+
+Compares the previous 48 kHz stereo WAV upload with the 16 kHz mono
+WAV, FLAC and Ogg/Opus encodings from encode_for_upload. If GROQ_API_KEY
+is set, every payload is also sent to Groq to measure end-to-end STT latency.
+
+Usage:
+    python benchmarks/upload_encoding.py [path/to/recording.wav]
+"""
+import io
+import os
+import sys
+import time
+import wave
+import statistics
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GUILD_ID", "0")
+
+from faster_whisper import decode_audio
+from audio import BYTES_PER_SECOND, encode_for_upload
+
+
+def load_pcm(path=None, seconds=8):
+    """
+    Loads a recording as 48 kHz stereo int16 PCM, or synthesizes a speech-like signal.
+
+    Args:
+        path: Optional audio file to load.
+        seconds: Length of the synthetic signal.
+
+    Returns:
+        Raw PCM as a bytearray.
+    """
+    if path:
+        audio = decode_audio(path, sampling_rate=48000, split_stereo=True)
+        stereo = np.stack(audio, axis=1)
+        return bytearray((np.clip(stereo, -1, 1) * 32767).astype(np.int16).tobytes())
+
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * 48000)) / 48000
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    voiced = sum(np.sin(2 * np.pi * f * t) / i for i, f in enumerate((140, 280, 420, 700, 1100), start=1))
+    signal = 0.2 * envelope * voiced + 0.01 * rng.standard_normal(t.size)
+    return bytearray((signal * 32767).astype(np.int16).repeat(2).tobytes())
+
+
+def legacy_wav(raw_pcm):
+    """
+    The previous upload: raw 48 kHz stereo WAV.
+    """
+    out_buffer = io.BytesIO()
+    with wave.open(out_buffer, 'wb') as wav_file:
+        wav_file.setnchannels(2)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(48000)
+        wav_file.writeframes(raw_pcm)
+    return "audio.wav", out_buffer.getvalue()
+
+
+def groq_latency(client, upload, runs=3):
+    """
+    Returns the median end-to-end transcription latency in milliseconds.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        client.audio.transcriptions.create(
+            file=upload,
+            model="whisper-large-v3-turbo",
+            temperature=0.0,
+            response_format="json"
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    raw_pcm = load_pcm(sys.argv[1] if len(sys.argv) > 1 else None)
+    seconds = len(raw_pcm) / BYTES_PER_SECOND
+
+    client = None
+    if os.getenv("GROQ_API_KEY"):
+        from groq import Groq
+        client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+
+    encoders = [
+        ("wav 48k stereo (old)", legacy_wav),
+        ("wav 16k mono", lambda pcm: encode_for_upload(pcm, "wav")),
+        ("flac 16k mono", lambda pcm: encode_for_upload(pcm, "flac")),
+        ("opus 16k mono", lambda pcm: encode_for_upload(pcm, "ogg")),
+    ]
+
+    print(f"Utterance length: {seconds:.1f}s")
+    print(f"{'format':<22} {'bytes':>10} {'ratio':>7} {'encode':>9} {'stt':>9}")
+    baseline = None
+    for name, encoder in encoders:
+        start = time.perf_counter()
+        upload = encoder(raw_pcm)
+        encode_ms = (time.perf_counter() - start) * 1000
+        size = len(upload[1])
+        baseline = baseline or size
+        stt = f"{groq_latency(client, upload):.0f}ms" if client else "n/a"
+        print(f"{name:<22} {size:>10} {baseline / size:>6.1f}x {encode_ms:>7.1f}ms {stt:>9}")
@@ -0,0 +1,80 @@
+"""
+Replays recorded utterances through the wake-word cascade.
+
+Each file in the directory is treated as one utterance. The cheap stage
+(detect_wake_word) runs on every file. With --verify, the full local model
+also runs on every file and its transcript is checked for a trigger anywhere,
+as without the cascade, so false rejections (including triggers said after
+WAKE_WORD_WINDOW) and false passes can be counted.
+
+Usage:
+    python benchmarks/wake_word_cascade.py recordings/ [--verify]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GUILD_ID", "0")
+
+from faster_whisper import decode_audio
+from config import *
+from stt import (
+    load_wake_word_model, transcribe_local, detect_wake_word,
+    cascade_stats, clean_transcript, contains_trigger
+)
+
+
+def load_pcm(path):
+    """
+    Loads an audio file as Discord PCM (48 kHz stereo int16).
+    """
+    left, right = decode_audio(path, sampling_rate=48000, split_stereo=True)
+    stereo = np.stack((left, right), axis=1)
+    return bytearray((np.clip(stereo, -1, 1) * 32767).astype(np.int16).tobytes())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory")
+    parser.add_argument("--verify", action="store_true", help="also run the full model to count missed triggers")
+    args = parser.parse_args()
+
+    load_wake_word_model()
+    files = sorted(os.path.join(args.directory, name) for name in os.listdir(args.directory))
+
+    check_time = 0.0
+    full_time = 0.0
+    missed = 0
+    false_passes = 0
+    for path in files:
+        raw_pcm = load_pcm(path)
+
+        start = time.perf_counter()
+        passed, head_text = detect_wake_word(raw_pcm)
+        check_time += time.perf_counter() - start
+
+        line = f"{'PASS' if passed else 'drop'}  {os.path.basename(path)}: {head_text!r}"
+        if args.verify:
+            start = time.perf_counter()
+            text = transcribe_local(raw_pcm)
+            full_time += time.perf_counter() - start
+            triggered = contains_trigger(clean_transcript(text))
+            if not passed and triggered:
+                missed += 1
+                line += f"  MISSED: {text!r}"
+            elif passed and not triggered:
+                false_passes += 1
+                line += f"  FALSE PASS: {text!r}"
+        print(line)
+
+    print()
+    print(cascade_stats.report())
+    if files:
+        print(f"Wake-word check: {check_time / len(files) * 1000:.0f} ms per utterance")
+    if args.verify and files:
+        print(f"Full transcription: {full_time / len(files) * 1000:.0f} ms per utterance")
+        print(f"False rejections: {missed}/{cascade_stats.rejected} rejected utterances")
+        print(f"False passes: {false_passes}/{cascade_stats.checked - cascade_stats.rejected} passed utterances")
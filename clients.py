@@ -0,0 +1,67 @@
+import asyncio
+import httpx
+from groq import AsyncGroq, DefaultAsyncHttpxClient
+from config import *
+
+
+# One pooled keep-alive connection set per upstream, shared by all guilds
+groq_client = AsyncGroq(
+    api_key=GROQ_API_KEY,
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=GROQ_STT_CONCURRENCY + GROQ_LLM_CONCURRENCY,
+            max_keepalive_connections=GROQ_STT_CONCURRENCY + GROQ_LLM_CONCURRENCY,
+            keepalive_expiry=KEEPALIVE_EXPIRY
+        )
+    )
+)
+
+tavily_http = httpx.AsyncClient(
+    base_url="https://api.tavily.com",
+    headers={"Authorization": f"Bearer {TAVILY_API_KEY}"},
+    limits=httpx.Limits(
+        max_connections=TAVILY_CONCURRENCY,
+        max_keepalive_connections=TAVILY_CONCURRENCY,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    ),
+    timeout=30.0
+)
+
+# Per-upstream concurrency limits, independent of the local CPU thread pool
+groq_stt_limit = asyncio.Semaphore(GROQ_STT_CONCURRENCY)
+groq_llm_limit = asyncio.Semaphore(GROQ_LLM_CONCURRENCY)
+tavily_limit = asyncio.Semaphore(TAVILY_CONCURRENCY)
+
+
+async def tavily_search(query, **params):
+    """
+    Runs a Tavily search over the shared connection pool.
+    (AsyncTavilyClient opens a new connection for every request.)
+
+    Args:
+        query: The search query.
+        **params: Extra search parameters (search_depth, max_tokens, ...).
+
+    Returns:
+        The parsed JSON response.
+    """
+    async with tavily_limit:
+        response = await tavily_http.post("/search", json={"query": query, **params})
+    response.raise_for_status()
+    return response.json()
+
+
+async def warm_up_connections():
+    """
+    Opens the pooled keep-alive connections to Groq and Tavily before the first
+    request, so it does not pay for DNS lookups and TLS handshakes.
+    """
+    results = await asyncio.gather(
+        groq_client.models.list(),
+        # Any response will do, only the open connection matters
+        tavily_http.get("/"),
+        return_exceptions=True
+    )
+    for name, result in zip(("Groq", "Tavily"), results):
+        if isinstance(result, Exception):
+            print(f"{name} Warm-up Error: {result}")
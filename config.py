@@ -20,21 +20,128 @@ ZONE = "Europe/Warsaw"
 # Text-to-Speech voice
 TTS_VOICE = "pl-PL-MarekNeural"
 
+# Number of synthesized phrases kept in memory for instant replay
+TTS_CACHE_SIZE = 64
+
+# Phrase synthesized once in the background at startup, warming up the TTS service
+TTS_WARM_UP_PHRASE = "OK."
+
 # If true, the models will run locally if possible
 RUN_LOCALLY = False
 
+# Local Whisper model settings (used only when RUN_LOCALLY = True)
+# For hosts without a GPU use WHISPER_DEVICE = "cpu" and WHISPER_COMPUTE_TYPE = "int8"
+WHISPER_MODEL = "large-v3-turbo"
+WHISPER_DEVICE = "cuda"
+WHISPER_COMPUTE_TYPE = "float16"
+WHISPER_CPU_THREADS = 0 # 0 lets CTranslate2 pick the thread count
+
+# Local utterances finishing within STT_BATCH_WINDOW seconds of each other are transcribed
+# together in one batched forward pass, up to STT_BATCH_SIZE at once (1 disables batching)
+STT_BATCH_SIZE = 4
+STT_BATCH_WINDOW = 0.05
+
+# Number of separate worker processes for local transcription, each with its own model.
+# 0 runs the model in a thread of the bot process.
+STT_WORKERS = 0
+
+# Local path only: when a user pauses for SPECULATIVE_PAUSE seconds, transcription of what was said
+# so far starts right away. At the end of the utterance only the audio after the last pause is left.
+SPECULATIVE_STT = True
+SPECULATIVE_PAUSE = 0.3
+
+# Audio format uploaded to Groq for transcription (always 16 kHz mono):
+# "wav" (uncompressed), "flac" (lossless) or "ogg" (Opus, smallest)
+UPLOAD_FORMAT = "flac"
+UPLOAD_OPUS_BITRATE = 32000
+
+# Utterance scheduling: utterances processed at once (all guilds), queued utterances kept per user,
+# maximum length of queued utterances merged into one, and age after which a waiting utterance is dropped
+MAX_IN_FLIGHT_UTTERANCES = 4
+MAX_QUEUED_PER_USER = 3
+MAX_MERGED_AUDIO_SECONDS = 30
+STALE_UTTERANCE_SECONDS = 20
+
+# Utterance buffers are preallocated with room for MAX_UTTERANCE_SECONDS of audio (~192 KB per second).
+# Longer speech is cut into segments of this length. Up to AUDIO_BUFFER_POOL_SIZE free buffers are kept for reuse.
+MAX_UTTERANCE_SECONDS = 30
+AUDIO_BUFFER_POOL_SIZE = 8
+
+# Maximum concurrent requests per upstream service and how long idle pooled connections are kept (seconds)
+GROQ_STT_CONCURRENCY = 8
+GROQ_LLM_CONCURRENCY = 8
+TAVILY_CONCURRENCY = 4
+KEEPALIVE_EXPIRY = 120
+
+# Tool results (web searches) are reused for this many seconds
+TOOL_CACHE_TTL = 300
+TOOL_CACHE_SIZE = 256
+
+# Approximate token budget of the conversation history sent to the LLM.
+# Older tool outputs are cut to TOOL_OUTPUT_HISTORY_CHARS, then the oldest turns are dropped.
+HISTORY_TOKEN_BUDGET = 3000
+TOOL_OUTPUT_HISTORY_CHARS = 400
+
+# Port of the local Prometheus metrics endpoint (http://127.0.0.1:PORT/metrics), 0 disables it.
+# In sharded mode every process serves its own metrics on METRICS_PORT + process index.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# File to append one JSON line with all stage timings per utterance, empty disables it
+TRACE_LOG_FILE = ""
+
+# Sharding: the guilds are split into SHARD_COUNT shards and every process connects only
+# the shards in SHARD_IDS. Set by shards.py for each process, 0 runs a single unsharded bot.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id] or None
+# Guilds that get the slash commands in sharded mode (comma-separated IDs in .env). Empty registers
+# them globally, for every guild the bot is in; Discord may take a while to show new global commands.
+COMMAND_GUILDS = [int(guild_id) for guild_id in os.getenv("COMMAND_GUILDS", "").split(",") if guild_id] or None
+
+# Where session controllers and conversation history are kept: "memory", or a path to
+# a SQLite file shared by all processes, so a guild keeps its state when another process takes it over
+STATE_STORE = os.getenv("STATE_STORE", "memory")
+
 # Enable or disable logging of transcriptions and responses
 LOGGING = True 
 
 # If false, the bot will transcribe all audio without requiring a trigger word.
 REQUIRE_TRIGGER = True
 
+# Two-stage trigger check: a small CPU Whisper model first looks for a trigger word
+# in the first WAKE_WORD_WINDOW seconds, only matching utterances get the full transcription.
+# On the local path it saves the full model pass on untriggered speech. With Groq it saves
+# transcription calls (cost and rate limit), but the check runs before every upload and adds
+# ~150-200 ms to each answered request, so there it is only used with WAKE_WORD_CASCADE_REMOTE.
+# Only the first WAKE_WORD_WINDOW seconds are checked: a trigger said later in an utterance
+# is rejected, while without the cascade it is found anywhere in the transcript.
+WAKE_WORD_CASCADE = True
+WAKE_WORD_CASCADE_REMOTE = False
+WAKE_WORD_MODEL = "base"
+WAKE_WORD_WINDOW = 2.5
+
+# Groq STT pricing used to report the savings of the cascade (USD per hour, minimum billed seconds per request)
+STT_COST_PER_HOUR = 0.04
+STT_MIN_BILLED_SECONDS = 10
+
 # Silence threshold in seconds to consider as silence
 SILENCE_THRESHOLD = 1.0
 
 # Minimum audio length in seconds to consider for transcription
 MIN_AUDIO_LENGTH = 0.6
 
+# RMS energy (int16 scale) above which a received frame counts as speech.
+# Quieter frames are treated as silence, so constant mic noise does not keep an utterance open.
+SPEECH_RMS_THRESHOLD = 300
+
+# Barge-in: keep listening while the bot speaks. The session controller stops the reply by talking
+# over it for BARGE_IN_SECONDS. During playback only frames above BARGE_IN_RMS_THRESHOLD count as speech.
+BARGE_IN = True
+BARGE_IN_SECONDS = 0.4
+BARGE_IN_RMS_THRESHOLD = 900
+
+
+# Answer simple requests (time, date, repeat, stop) from INTENT_TEMPLATES without calling the LLM
+FAST_INTENTS = True
 
 # Trigger words
 TRIGGERS = ["jarvis", "dlarwis", "jarewis", "elvis", "dziarowijs", "dziadowiz", "jarvan", "jarwis", "rarwis", "garmin", "jarvi", "garvis"] 
@@ -63,6 +170,23 @@ if LANGUAGE.lower() == "en":
     The most important: Respond briefly and concisely.
     """.strip()
 
+    # Fast-path intents answered without the LLM. Patterns must match the whole request
+    # (lowercase, without punctuation and trigger words).
+    INTENT_PATTERNS = {
+        "time": r"(?:(?:hey|ok|okay|please|so|tell me|can you tell me|do you know)\s+)*(?:what(?:'s|s| is)? the time|what time is it|(?:the )?current time)(?:\s+(?:now|right now|please))?",
+        "date": r"(?:(?:hey|ok|okay|please|so|tell me|can you tell me|do you know)\s+)*(?:what(?:'s|s| is)? (?:the |today's |todays )?date(?: today)?|what day is (?:it|today)(?: today)?|what is today)(?:\s+please)?",
+        "repeat": r"(?:(?:hey|ok|okay|please|can you|could you)\s+)*(?:repeat(?: that| it| please| the answer| your answer)*|say (?:that|it) again(?: please)?|come again|what did you say)",
+        "stop": r"(?:stop|stop talking|be quiet|quiet|shut up|enough|cancel)(?:\s+(?:it|now|please))*",
+    }
+    INTENT_TEMPLATES = {
+        "time": "It's {time}.",
+        "date": "Today is {weekday}, {month} {day}, {year}.",
+        "repeat_empty": "I haven't said anything yet.",
+    }
+    WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+              "August", "September", "October", "November", "December"]
+
 elif LANGUAGE.lower() == "pl":
     IGNORED_PHRASES = [
         "okej", "dobra", "tak", "nie", "Wszelkie prawa zastrzeżone", "Dziękuję."
@@ -77,5 +201,22 @@ elif LANGUAGE.lower() == "pl":
     gdy nie znasz odpowiedzi na pytanie użytkownika lub gdy potrzebujesz najnowszych informacji.
     Najważniejsze: Odpowiadaj krótko i zwięźle. 
     """.strip()
+
+    INTENT_PATTERNS = {
+        "time": r"(?:(?:hej|ok|okej|proszę|powiedz|powiedz mi|czy wiesz|a)\s+)*(?:(?:która|jaka) (?:jest )?(?:teraz )?godzina(?: teraz)?|ile jest godzin|podaj (?:aktualną )?godzinę)(?:\s+proszę)?",
+        "date": r"(?:(?:hej|ok|okej|proszę|powiedz|powiedz mi|czy wiesz|a)\s+)*(?:jaki (?:jest |mamy )?(?:dziś |dzisiaj )?dzień(?: dziś| dzisiaj)?|jaka (?:jest )?(?:dziś |dzisiaj )?data(?: dziś| dzisiaj)?|którego (?:jest |mamy )?(?:dziś|dzisiaj))(?:\s+proszę)?",
+        "repeat": r"(?:(?:hej|ok|okej|proszę|możesz)\s+)*(?:powtórz(?: to| proszę| jeszcze raz| odpowiedź)*|powiedz (?:to )?jeszcze raz|co powiedziałeś)",
+        "stop": r"(?:stop|przestań|przestań mówić|cisza|wystarczy|zamilcz|koniec|dość)(?:\s+(?:już|proszę))*",
+    }
+    INTENT_TEMPLATES = {
+        "time": "Jest {time}.",
+        "date": "Dzisiaj jest {weekday}, {day} {month} {year} roku.",
+        "repeat_empty": "Jeszcze nic nie powiedziałem.",
+    }
+    WEEKDAYS = ["poniedziałek", "wtorek", "środa", "czwartek", "piątek", "sobota", "niedziela"]
+    MONTHS = ["stycznia", "lutego", "marca", "kwietnia", "maja", "czerwca", "lipca",
+              "sierpnia", "września", "października", "listopada", "grudnia"]
 else:
-    IGNORED_PHRASES = []
\ No newline at end of file
+    IGNORED_PHRASES = []
+    INTENT_PATTERNS = {}
+    INTENT_TEMPLATES = {}
\ No newline at end of file
@@ -0,0 +1,83 @@
+from config import *
+
+
+def estimate_tokens(message):
+    """
+    Roughly estimates the prompt tokens of one message (about 4 characters per token).
+
+    Args:
+        message: A chat message dict.
+
+    Returns:
+        The estimated token count.
+    """
+    chars = len(message.get("content") or "")
+    for tool_call in message.get("tool_calls") or []:
+        chars += len(tool_call["function"]["name"]) + len(tool_call["function"]["arguments"])
+    # Role and formatting overhead
+    return chars // 4 + 4
+
+
+def split_turns(history):
+    """
+    Splits the history (without the system prompt) into turns.
+    A turn starts with a user message and holds everything up to the next one,
+    so an assistant tool call always stays together with its tool replies.
+
+    Args:
+        history: The conversation history including the system prompt.
+
+    Returns:
+        A list of turns, each a list of messages.
+    """
+    turns = []
+    for message in history[1:]:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def shorten_tool_output(message, max_chars):
+    """
+    Truncates the content of a tool reply that is no longer needed in full.
+
+    Args:
+        message: A tool message dict.
+        max_chars: Maximum number of characters to keep.
+
+    Returns:
+        The message with shortened content (a new dict if it was changed).
+    """
+    content = message.get("content") or ""
+    if len(content) <= max_chars:
+        return message
+    return {**message, "content": content[:max_chars] + "… [truncated]"}
+
+
+def compact_history(history, budget=None):
+    """
+    Keeps the history under the token budget, in place.
+    Tool outputs of older turns are shortened first, then whole turns are
+    evicted from the oldest. The system prompt and the latest turn are always kept.
+
+    Args:
+        history: The conversation history including the system prompt.
+        budget: Token budget, defaults to HISTORY_TOKEN_BUDGET.
+    """
+    budget = budget or HISTORY_TOKEN_BUDGET
+    turns = split_turns(history)
+    if not turns:
+        return
+
+    for turn in turns[:-1]:
+        for i, message in enumerate(turn):
+            if message["role"] == "tool":
+                turn[i] = shorten_tool_output(message, TOOL_OUTPUT_HISTORY_CHARS)
+
+    total = estimate_tokens(history[0]) + sum(estimate_tokens(m) for turn in turns for m in turn)
+    while len(turns) > 1 and total > budget:
+        evicted = turns.pop(0)
+        total -= sum(estimate_tokens(m) for m in evicted)
+
+    history[1:] = [message for turn in turns for message in turn]
@@ -0,0 +1,68 @@
+import re
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from config import *
+
+
+_patterns = {intent: re.compile(pattern) for intent, pattern in INTENT_PATTERNS.items()}
+
+
+def match_intent(clean_text):
+    """
+    Matches a request against the fast-path intents of the current LANGUAGE.
+    Only requests that consist entirely of a known phrase match, so
+    "what time is it in Tokyo" still goes to the LLM.
+
+    Args:
+        clean_text: Text returned by clean_transcript.
+
+    Returns:
+        The intent name ("time", "date", "repeat" or "stop") or None.
+    """
+    if not FAST_INTENTS:
+        return None
+
+    request = " ".join(word for word in clean_text.split() if word not in TRIGGERS)
+    for intent, pattern in _patterns.items():
+        if pattern.fullmatch(request):
+            return intent
+    return None
+
+
+def last_answer(conversation_history):
+    """
+    Returns the last spoken assistant answer in the conversation, or None.
+    """
+    for message in reversed(conversation_history):
+        if message["role"] == "assistant" and message.get("content") and not message.get("tool_calls"):
+            return message["content"]
+    return None
+
+
+def intent_response(intent, conversation_history):
+    """
+    Builds the answer to a fast-path intent from INTENT_TEMPLATES.
+
+    Args:
+        intent: Intent name returned by match_intent.
+        conversation_history: The guild's conversation, used to repeat the last answer.
+
+    Returns:
+        The text to speak, or None for intents without an answer (stop).
+    """
+    if intent == "time":
+        return INTENT_TEMPLATES["time"].format(time=datetime.now(ZoneInfo(ZONE)).strftime("%H:%M"))
+
+    if intent == "date":
+        now = datetime.now(ZoneInfo(ZONE))
+        return INTENT_TEMPLATES["date"].format(
+            weekday=WEEKDAYS[now.weekday()],
+            day=now.day,
+            month=MONTHS[now.month - 1],
+            year=now.year
+        )
+
+    if intent == "repeat":
+        return last_answer(conversation_history) or INTENT_TEMPLATES["repeat_empty"]
+
+    return None
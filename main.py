@@ -1,72 +1,115 @@
-import discord
-from discord.ext import tasks
-from faster_whisper import WhisperModel
-import io
-import wave
 import time
+started_at = time.monotonic()
+
+import discord
 import asyncio
 import threading
 from concurrent.futures import ThreadPoolExecutor
 from config import *
-from groq import Groq, BadRequestError
-from tavily import TavilyClient
-import edge_tts
-import json
-from datetime import datetime
-from zoneinfo import ZoneInfo
+from stt import (
+    load_whisper_model, load_wake_word_model, detect_wake_word, TranscriptionBatcher, transcribe_batch,
+    cascade_stats, clean_transcript, contains_trigger
+)
+from stt_workers import STTWorkerPool
+from session import get_session
+from scheduler import Job, UtteranceScheduler
+from metrics import Trace, span, mark, record, register_gauge, render_table, start_metrics_server, startup_report
+from history import compact_history
+from intents import match_intent, intent_response
+from tools import tool_executor, tools_schema
+from tts import SentenceSplitter, clean_for_speech, synthesize, discard_synthesis, warm_up_tts
+from audio import BYTES_PER_SECOND, buffer_pool, is_speech_frame, encode_for_upload, SilenceSource
+from groq import APIError, APIStatusError, APIConnectionError, BadRequestError
+from clients import groq_client, groq_stt_limit, groq_llm_limit, warm_up_connections
+
+startup_report.start(started_at)
+startup_report.mark("imports")
 
 print("Starting bot...")
 
-bot = discord.Bot(debug_guilds=[GUILD_ID])
+if SHARD_COUNT:
+    # Only the process running shard 0 syncs the slash commands, the others would just repeat it.
+    # The commands are global (or in COMMAND_GUILDS), so guilds on every shard can use /join.
+    bot = discord.AutoShardedBot(
+        debug_guilds=COMMAND_GUILDS,
+        shard_count=SHARD_COUNT,
+        shard_ids=SHARD_IDS,
+        auto_sync_commands=not SHARD_IDS or 0 in SHARD_IDS
+    )
+    print(f"Running shards {SHARD_IDS or list(range(SHARD_COUNT))} of {SHARD_COUNT}")
+else:
+    bot = discord.Bot(debug_guilds=[GUILD_ID])
 
 thread_pool = ThreadPoolExecutor(max_workers=3)
-model_lock = asyncio.Lock()
-bot_controllers = {}
-
-groq = Groq(api_key=GROQ_API_KEY)
-tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
-
-IS_SPEAKING = False # Don't change this - used to TTS state management
-
-conversation_history = [
-    {
-        "role": "system",
-        "content": SYSTEM_PROMPT
-    }
-]
-
-tools_schema = [
-    {
-        "type": "function",
-        "function": {
-            "name": "web_search",
-            "description": "Get current information from the internet (weather, news, facts). Use this when the user asks about something that requires up-to-date knowledge.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string",
-                        "description": "The search query to send to the search engine (e.g. 'current weather in Warsaw', 'who won the match yesterday')."
-                    }
-                },
-                "required": ["query"],
-            },
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "current_time",
-            "description": "Fetch the current date and time in the user's local time zone.",
-            "parameters": {
-                "type": "object",
-                "properties": {},
-                "required": [],
-            },
-        }
-    }
-]
+if STT_WORKERS:
+    stt_workers = STTWorkerPool()
+    stt_batcher = TranscriptionBatcher(stt_workers.transcribe_batch, concurrency=STT_WORKERS)
+else:
+    stt_workers = None
+    stt_batcher = TranscriptionBatcher(lambda raw_pcms: bot.loop.run_in_executor(thread_pool, transcribe_batch, raw_pcms))
+
+async def stream_completion(emit, stage="llm", **kwargs):
+    """
+    Runs a streamed chat completion. Content is passed to emit as it arrives,
+    tool call fragments are collected until the stream ends.
+
+    Args:
+        emit: Called with every piece of content text.
+        stage: Stage name used for latency metrics.
+        **kwargs: Arguments for groq_client.chat.completions.create.
+
+    Returns:
+        A (content, tool_calls) tuple, where tool_calls is a list of dicts in the API message format.
+    """
+    content = []
+    tool_calls = {}
+
+    async with groq_llm_limit:
+        start = time.monotonic()
+        first_token = True
+        stream = await groq_client.chat.completions.create(stream=True, **kwargs)
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+
+            if first_token and (delta.content or delta.tool_calls):
+                record(f"{stage}_first_token", time.monotonic() - start)
+                first_token = False
+
+            if delta.content:
+                content.append(delta.content)
+                emit(delta.content)
+
+            for fragment in delta.tool_calls or []:
+                call = tool_calls.setdefault(fragment.index, {
+                    "id": "",
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                })
+                if fragment.id:
+                    call["id"] = fragment.id
+                if fragment.function:
+                    if fragment.function.name:
+                        call["function"]["name"] += fragment.function.name
+                    if fragment.function.arguments:
+                        call["function"]["arguments"] += fragment.function.arguments
+
+        record(stage, time.monotonic() - start)
 
+    return "".join(content), [tool_calls[index] for index in sorted(tool_calls)]
+
+
+def is_request_error(e):
+    """
+    Returns True for Groq errors caused by the request itself, such as tool_use_failed,
+    which are worth retrying without tools. With streaming they arrive either as a
+    400 response or as an error event inside the stream (a plain APIError).
+
+    Args:
+        e: The groq.APIError.
+    """
+    return isinstance(e, BadRequestError) or not isinstance(e, (APIStatusError, APIConnectionError))
 
 
 async def finished_callback(sink, channel: discord.TextChannel, *args):
@@ -82,17 +125,29 @@ async def finished_callback(sink, channel: discord.TextChannel, *args):
 
 
 class AutoCutSink(discord.sinks.PCMSink):
-    def __init__(self, dest_channel):
+    def __init__(self, session, dest_channel, loop, on_utterance, on_barge_in=None, on_pause=None, ignored_user_id=None):
         super().__init__()
+        self.session = session
         self.dest_channel = dest_channel
+        self.loop = loop
+        self.on_utterance = on_utterance
+        self.on_barge_in = on_barge_in
+        self.on_pause = on_pause
+        self.ignored_user_id = ignored_user_id
         self.user_data_buffer = {}     
         self.last_spoken_time = {}   
+        self.pending_cuts = set()
+        self.loud_since = {}
+        # Speculative transcripts per user: (end offset in the buffer, task) of each chunk
+        self.partials = {}
+        self.speculated = {}
         self.packets_received = 0
         self.lock = threading.Lock()
 
     def write(self, data, user):
         
-        if IS_SPEAKING: 
+        speaking = self.session.is_speaking
+        if speaking and not BARGE_IN: 
             return
 
         try:
@@ -103,161 +158,592 @@ class AutoCutSink(discord.sinks.PCMSink):
                 return
 
             user_id = user.id if hasattr(user, 'id') else int(user)
+            if user_id == self.ignored_user_id:
+                # Never listen to the bot's own output
+                return
 
-            with self.lock:
-                if user_id not in self.user_data_buffer:
-                    self.user_data_buffer[user_id] = bytearray()
-                
-                if hasattr(data, 'data'):
-                    self.user_data_buffer[user_id].extend(data.data)
-                else:
-                    self.user_data_buffer[user_id].extend(data)
+            pcm = data.data if hasattr(data, 'data') else data
+            # While the bot talks, only loud speech counts, so echo of the reply does not open utterances
+            is_speech = is_speech_frame(pcm, BARGE_IN_RMS_THRESHOLD if speaking else None)
+            now = time.monotonic()
 
-                self.last_spoken_time[user_id] = time.time()
+            full_buffer = None
+            full_partials = None
+            barge_in = False
+            with self.lock:
+                buffer = self.user_data_buffer.get(user_id)
+                if buffer is None:
+                    # Silent or noise-only packets never open a new utterance
+                    if not is_speech:
+                        return
+                    buffer = self.user_data_buffer[user_id] = buffer_pool.acquire()
+
+                written = buffer.append(pcm)
+                if written < len(pcm):
+                    # MAX_UTTERANCE_SECONDS reached, cut here and continue in a fresh buffer
+                    full_buffer = buffer
+                    full_partials = self.partials.pop(user_id, [])
+                    self.speculated.pop(user_id, None)
+                    buffer = self.user_data_buffer[user_id] = buffer_pool.acquire()
+                    buffer.append(memoryview(pcm)[written:])
+
+                if is_speech:
+                    self.last_spoken_time[user_id] = now
+                    if speaking and self.on_barge_in:
+                        barge_in = self.sustained_speech(user_id, now)
                 self.packets_received += 1
 
+                schedule_cut = user_id not in self.pending_cuts
+                if schedule_cut:
+                    self.pending_cuts.add(user_id)
+
+            if barge_in:
+                self.loop.call_soon_threadsafe(self.on_barge_in, self, user_id)
+            if full_buffer:
+                self.loop.call_soon_threadsafe(self.hand_off, user_id, full_buffer, now, full_partials)
+            if schedule_cut:
+                delay = SPECULATIVE_PAUSE if self.on_pause else SILENCE_THRESHOLD
+                self.loop.call_soon_threadsafe(self.loop.call_later, delay, self.check_endpoint, user_id)
+
         except Exception as e:
             print(f"Write Error: {e}")
 
+    def check_endpoint(self, user_id):
+        """
+        Runs on the event loop when the user's silence deadline may have passed.
+        If the user spoke again in the meantime, the check is rescheduled for
+        exactly the remaining time, otherwise the utterance is cut and handed on.
+        With on_pause set, a pause of SPECULATIVE_PAUSE already starts transcribing
+        the audio so far, so only the rest is left when the utterance ends.
+
+        Args:
+            user_id: The ID of the user whose utterance is checked.
+        """
+        try:
+            with self.lock:
+                last_seen = self.last_spoken_time.get(user_id)
+                if last_seen is None:
+                    self.pending_cuts.discard(user_id)
+                    return
+
+                now = time.monotonic()
+                remaining = last_seen + SILENCE_THRESHOLD - now
+                if remaining > 0:
+                    if self.on_pause and self.speculated.get(user_id) != last_seen:
+                        pause_left = last_seen + SPECULATIVE_PAUSE - now
+                        if pause_left > 0:
+                            self.loop.call_later(pause_left, self.check_endpoint, user_id)
+                            return
+                        self.speculate(user_id, last_seen)
+                    self.loop.call_later(remaining, self.check_endpoint, user_id)
+                    return
+
+                buffer = self.user_data_buffer.pop(user_id, None)
+                partials = self.partials.pop(user_id, [])
+                self.speculated.pop(user_id, None)
+                del self.last_spoken_time[user_id]
+                self.pending_cuts.discard(user_id)
+
+            if buffer:
+                self.hand_off(user_id, buffer, last_seen, partials)
+
+        except Exception as e:
+            print(f"Endpoint Error: {e}")
+
+    def speculate(self, user_id, last_seen):
+        """
+        Starts transcribing the audio received since the previous pause.
+        Called with the lock held when the user pauses.
+
+        Args:
+            user_id: The ID of the user who paused.
+            last_seen: time.monotonic() of the last speech frame before the pause.
+        """
+        self.speculated[user_id] = last_seen
+        buffer = self.user_data_buffer[user_id]
+        partials = self.partials.setdefault(user_id, [])
+        start = partials[-1][0] if partials else 0
+        end = len(buffer)
+        if end - start >= BYTES_PER_SECOND * MIN_AUDIO_LENGTH:
+            previous = partials[-1][1] if partials else None
+            # Copied: the transcription may still run in an executor after the buffer went back
+            # to the pool (a cancelled task does not stop its thread), a view would be overwritten
+            chunk = bytes(buffer.view()[start:end])
+            partials.append((end, self.on_pause(self, user_id, chunk, previous)))
+
+    def sustained_speech(self, user_id, now):
+        """
+        Tracks loud speech during playback. Called with the lock held for every
+        speech frame while the bot is speaking.
+
+        Args:
+            user_id: The ID of the user who spoke.
+            now: time.monotonic() of the frame.
+
+        Returns:
+            True once the user has spoken for BARGE_IN_SECONDS without a longer pause.
+        """
+        start, last = self.loud_since.get(user_id, (now, now))
+        if now - last > 0.25:
+            start = now
+        if now - start >= BARGE_IN_SECONDS:
+            del self.loud_since[user_id]
+            return True
+        self.loud_since[user_id] = (start, now)
+        return False
+
+    def cleanup(self):
+        """
+        Returns unfinished utterance buffers to the pool when recording stops.
+        """
+        with self.lock:
+            for buffer in self.user_data_buffer.values():
+                buffer.release()
+            for partials in self.partials.values():
+                for _, task in partials:
+                    task.cancel()
+            self.user_data_buffer.clear()
+            self.last_spoken_time.clear()
+            self.partials.clear()
+            self.speculated.clear()
+        super().cleanup()
+
+    def hand_off(self, user_id, buffer, speech_end, partials=()):
+        """
+        Passes a finished utterance buffer on, or returns it to the pool if it is too short.
+        The receiver owns the buffer and releases it after processing.
+
+        Args:
+            user_id: The ID of the user who spoke.
+            buffer: The PCMBuffer with the utterance.
+            speech_end: time.monotonic() of the end of the utterance.
+            partials: Speculative transcripts of the beginning of the utterance.
+        """
+        if len(buffer) >= BYTES_PER_SECOND * MIN_AUDIO_LENGTH:
+            self.on_utterance(self, user_id, buffer, speech_end, partials)
+        else:
+            buffer.release()
+            for _, task in partials:
+                task.cancel()
+
+
+def make_sink(session, channel):
+    """
+    Creates the AutoCutSink of a guild with all pipeline callbacks connected.
+
+    Args:
+        session: The guild's GuildSession.
+        channel: The text channel for transcripts and replies.
+
+    Returns:
+        The new sink.
+    """
+    return AutoCutSink(
+        session, channel, bot.loop, handle_utterance,
+        on_barge_in=handle_barge_in,
+        on_pause=speculate if RUN_LOCALLY and SPECULATIVE_STT else None,
+        ignored_user_id=bot.user.id if bot.user else None
+    )
+
+
+def handle_utterance(sink, user_id, audio_data, speech_end, partials=()):
+    """
+    Hands a finished utterance to the scheduler. Called by AutoCutSink on the event loop.
+    Utterances of the session controller are processed first. An utterance made while
+    the bot answers the same user skips the in-flight cap, so "stop" is heard at once.
+
+    Args:
+        sink: The AutoCutSink that captured the audio.
+        user_id: The ID of the user who spoke.
+        audio_data: PCMBuffer with the utterance, released by the scheduler.
+        speech_end: time.monotonic() of the last speech frame.
+        partials: Speculative transcripts of the beginning of the utterance.
+    """
+    guild = sink.dest_channel.guild
+    trace = Trace(guild.id, user_id, start=speech_end)
+    trace.mark("endpoint")
+    is_controller = sink.session.controller_id == user_id
+    urgent = sink.session.replying_to == user_id
+    scheduler.submit(Job(
+        guild, user_id, audio_data, sink.dest_channel,
+        priority=is_controller, urgent=urgent, trace=trace, partials=partials
+    ))
+
+
+def speculate(sink, user_id, chunk, previous=None):
+    """
+    Starts transcribing part of an utterance while the user pauses.
+    Called by AutoCutSink on the event loop.
+
+    Args:
+        sink: The AutoCutSink that captured the audio.
+        user_id: The ID of the user who paused.
+        chunk: PCM bytes of the audio since the previous pause.
+        previous: Task of the previous chunk of the utterance, None for the first chunk.
+
+    Returns:
+        The asyncio Task that produces the partial text.
+    """
+    return asyncio.create_task(transcribe_partial(chunk, previous))
+
+
+async def transcribe_partial(chunk, previous):
+    """
+    Transcribes one speculative chunk. With the wake-word cascade, the first chunk
+    only gets the cheap check, and the full model runs once it found a trigger,
+    so untriggered chatter never costs a full transcription.
+
+    Args:
+        chunk: PCM bytes of the audio since the previous pause.
+        previous: Task of the previous chunk, None for the first chunk.
+
+    Returns:
+        The partial text, or None if the wake-word check rejected the utterance.
+    """
+    if previous is None:
+        if wake_word_cascade():
+            passed, head_text = await check_wake_word(chunk)
+            if not passed:
+                return None
+    elif await previous is None:
+        return None
+    return await transcribe(chunk, stage="stt_speculative")
+
 
-@tasks.loop(seconds=0.5)
-async def check_silence_task():
+async def speculative_verdict(partials):
     """
-    Checks if users have stopped speaking and triggers transcription.
+    Returns the wake-word verdict of the first speculative chunk: True if it
+    passed, False if it was rejected and None if the chunk failed.
     """
     try:
-        if IS_SPEAKING:
-            return
+        return await partials[0][1] is not None
+    except Exception as e:
+        print(f"Speculative STT Error: {e}")
+        return None
 
-        for guild in bot.guilds:
-            vc = guild.voice_client
-            if not vc or not vc.recording or not isinstance(vc.sink, AutoCutSink):
-                continue
-            
-            sink = vc.sink
-            current_time = time.time()
 
-            target_text_channel = sink.dest_channel
-            
-            with sink.lock:
-                active_users = list(sink.last_spoken_time.keys())
-                to_process = []
-
-                for user_id in active_users:
-                    last_seen = sink.last_spoken_time[user_id]
-                    if current_time - last_seen > SILENCE_THRESHOLD:
-                        audio_data = sink.user_data_buffer.pop(user_id, None)
-                        del sink.last_spoken_time[user_id]
-                        
-                        if audio_data and len(audio_data) >= 192000 * MIN_AUDIO_LENGTH:
-                            to_process.append((user_id, audio_data))
+def wake_word_cascade():
+    """
+    Returns True if utterances go through the wake-word check before the full transcription.
+    """
+    return REQUIRE_TRIGGER and WAKE_WORD_CASCADE and (RUN_LOCALLY or WAKE_WORD_CASCADE_REMOTE)
+
+
+async def check_wake_word(raw_pcm):
+    """
+    Runs the cheap first stage of the trigger cascade off the event loop.
+
+    Args:
+        raw_pcm: Raw PCM of the utterance, only its beginning is checked.
+
+    Returns:
+        A (passed, text) tuple.
+    """
+    with span("wake_word"):
+        if stt_workers:
+            return await stt_workers.detect_wake_word(raw_pcm)
+        return await bot.loop.run_in_executor(thread_pool, detect_wake_word, raw_pcm)
+
+
+async def transcribe(raw_pcm, stage="stt"):
+    """
+    Transcribes PCM audio with the local model or the Groq API.
+
+    Args:
+        raw_pcm: Raw PCM audio (48 kHz stereo int16).
+        stage: Stage name used for latency metrics.
+
+    Returns:
+        The transcribed text.
+    """
+    if RUN_LOCALLY:
+        with span(stage):
+            return await stt_batcher.transcribe(raw_pcm)
+
+    with span(f"{stage}_encode"):
+        upload = await bot.loop.run_in_executor(thread_pool, encode_for_upload, raw_pcm)
+    async with groq_stt_limit:
+        with span(stage):
+            transcription = await groq_client.audio.transcriptions.create(
+                file=upload, 
+                model="whisper-large-v3-turbo",
+                prompt=INITIAL_PROMPT if REQUIRE_TRIGGER else None,
+                temperature=0.0, 
+                language=LANGUAGE.lower(), 
+                response_format="json"
+            )
+    return transcription.text.strip()
+
+
+async def finish_transcript(raw_pcm, partials):
+    """
+    Completes the transcript of an utterance. Text of the chunks transcribed
+    while the user paused is reused, and only the audio after the last pause
+    is transcribed now. Falls back to the whole utterance if a chunk failed.
 
-            for user_id, audio_data in to_process:
-                asyncio.create_task(process_transcription(guild, user_id, audio_data, target_text_channel))
+    Args:
+        raw_pcm: Raw PCM of the whole utterance.
+        partials: (end offset, task) of each speculative chunk.
+
+    Returns:
+        The full transcribed text.
+    """
+    offset = partials[-1][0] if partials else 0
+    tail = None
+    # A tail shorter than a word is only trailing noise
+    if not partials or len(raw_pcm) - offset >= BYTES_PER_SECOND * 0.3:
+        tail = asyncio.create_task(transcribe(raw_pcm[offset:]))
 
+    try:
+        texts = [await task for _, task in partials]
     except Exception as e:
-        print(f"Silence Loop Error: {e}")
+        print(f"Speculative STT Error: {e}")
+        if tail:
+            tail.cancel()
+        return await transcribe(raw_pcm)
+
+    if tail:
+        texts.append(await tail)
+    return " ".join(text for text in texts if text).strip()
 
 
-async def speak_response(vc, text):
+def handle_barge_in(sink, user_id):
     """
-    Converts text to speech and plays it in the voice channel.
-    
+    Stops the current reply when the session controller talks over it.
+    Called by AutoCutSink on the event loop. The interrupting speech is already
+    being captured and becomes the next utterance.
+
     Args:
-        vc: The voice client.
-        text: The text to convert to speech.
+        sink: The AutoCutSink that detected the speech.
+        user_id: The ID of the user who spoke.
+    """
+    guild = sink.dest_channel.guild
+    if sink.session.controller_id != user_id:
+        return
+    if stop_playback(guild):
+        print(f"Barge-in by {user_id}, stopping playback")
+
+
+def stop_playback(guild, pending=False):
+    """
+    Stops the reply that is playing in a guild and skips the rest of it.
+
+    Args:
+        guild: The Discord guild.
+        pending: Also cancel the replies still generating or waiting to play.
+
+    Returns:
+        True if a reply was stopped.
+    """
+    session = get_session(guild.id)
+    stopped = False
+    if pending:
+        for reply in list(session.replies):
+            reply.cancel()
+            stopped = True
+
+    if not session.is_speaking or session.interrupted:
+        return stopped
+
+    session.interrupted = True
+    vc = guild.voice_client
+    if vc and vc.is_playing():
+        vc.stop()
+    return True
+
+
+async def speak_stream(vc, text_queue, user_id=None):
     """
+    Speaks streamed text sentence by sentence. Each sentence is synthesized as soon
+    as it is complete and played while later sentences are still generating.
 
-    global IS_SPEAKING
+    Args:
+        vc: The voice client.
+        text_queue: asyncio.Queue of text pieces, terminated by None.
+        user_id: The ID of the user the reply answers.
+    """
     if not vc or not vc.is_connected(): 
         return
-    
-    IS_SPEAKING = True
-    
-    communicate = edge_tts.Communicate(text, TTS_VOICE)
-    filename = "response.mp3"
-    await communicate.save(filename)
 
-    if vc.is_playing():
-        vc.stop()
+    session = get_session(vc.guild.id)
+    reply = asyncio.current_task()
+    session.replies.add(reply)
+    synth_queue = asyncio.Queue()
+    first_audio = True
+
+    async def split_sentences():
+        splitter = SentenceSplitter()
+        while True:
+            delta = await text_queue.get()
+            if delta is None:
+                break
+            for sentence in splitter.feed(delta):
+                synth_queue.put_nowait(asyncio.create_task(synthesize(clean_for_speech(sentence))))
+
+        rest = splitter.flush()
+        if rest:
+            synth_queue.put_nowait(asyncio.create_task(synthesize(clean_for_speech(rest))))
+        synth_queue.put_nowait(None)
+
+    splitter_task = asyncio.create_task(split_sentences())
+
+    # The outer finally also runs when the reply is cancelled while waiting for playback
+    try:
+        async with session.playback_lock:
+            session.interrupted = False
+            session.replying_to = user_id
+            try:
+                while True:
+                    synth_task = await synth_queue.get()
+                    if synth_task is None:
+                        break
+                    if session.interrupted:
+                        discard_synthesis(synth_task)
+                        break
+
+                    try:
+                        source = await synth_task
+                    except Exception as e:
+                        print(f"TTS Error: {e}")
+                        continue
+
+                    try:
+                        if not vc.is_connected() or session.interrupted:
+                            source.cleanup()
+                            continue
+
+                        session.is_speaking = True
+                        if vc.is_playing():
+                            vc.stop()
+
+                        finished = asyncio.Event()
+
+                        def after_tts(error):
+                            if error: 
+                                print(f"TTS Error: {error}")
+                            bot.loop.call_soon_threadsafe(finished.set)
+
+                        vc.play(source, after=after_tts)
+                        if first_audio:
+                            mark("first_audio")
+                            first_audio = False
+                        await finished.wait()
+                    except Exception as e:
+                        print(f"Play Error: {e}")
+            finally:
+                session.is_speaking = False
+                session.replying_to = None
+                play_keep_alive(vc)
+    finally:
+        session.replies.discard(reply)
+        splitter_task.cancel()
+        while not synth_queue.empty():
+            pending = synth_queue.get_nowait()
+            if pending:
+                discard_synthesis(pending)
+
+
+async def speak_response(vc, text, user_id=None):
+    """
+    Converts text to speech and plays it in the voice channel.
     
-    await asyncio.sleep(0.1)
+    Args:
+        vc: The voice client.
+        text: The text to convert to speech.
+        user_id: The ID of the user the reply answers.
+    """
+    text_queue = asyncio.Queue()
+    text_queue.put_nowait(text)
+    text_queue.put_nowait(None)
+    await speak_stream(vc, text_queue, user_id)
 
-    def after_tts(error):
-        global IS_SPEAKING
-        if error: 
-            print(f"TTS Error: {error}")
-        
-        IS_SPEAKING = False
-        play_keep_alive(vc)
 
-    try:
-        source = discord.FFmpegPCMAudio(filename)
-        vc.play(source, after=after_tts)
-    except Exception as e:
-        print(f"Play Error: {e}")
-        IS_SPEAKING = False
-        play_keep_alive(vc)
+async def answer_intent(intent, guild, user_id, channel, text):
+    """
+    Answers a fast-path intent from its template, without calling the LLM.
 
+    Args:
+        intent: Intent name returned by match_intent.
+        guild: The Discord guild (server).
+        user_id: The ID of the user who asked.
+        channel: The Discord text channel.
+        text: The transcribed request.
 
-async def process_transcription(guild, user_id, raw_pcm, channel):
+    Returns:
+        The task playing the answer, or None.
+    """
+    session = get_session(guild.id)
+    if intent == "stop":
+        # Stop means silence, replies queued behind the current one are dropped too
+        stop_playback(guild, pending=True)
+        return None
+
+    with span("intent"):
+        response_text = intent_response(intent, session.conversation_history)
+    print(f"Fast path ({intent}): {response_text}")
+
+    if intent != "repeat":
+        async with session.turn_lock:
+            session.conversation_history.append({"role": "user", "content": text})
+            session.conversation_history.append({"role": "assistant", "content": response_text})
+            compact_history(session.conversation_history)
+            await session.save_history()
+
+    speaker = asyncio.create_task(speak_response(guild.voice_client, response_text, user_id))
+    if LOGGING:
+        embed = discord.Embed(description=response_text, color=discord.Color.red())
+        embed.set_author(name=bot.user.name, icon_url=bot.user.avatar.url if bot.user.avatar else None)
+        await channel.send(embed=embed)
+    return speaker
+
+
+async def process_transcription(guild, user_id, raw_pcm, channel, partials=()):
     """
     Processes raw audio data into text and sends it to Discord.
 
     Args:
         guild: The Discord guild (server).
         user_id: The ID of the user who spoke.
-        raw_pcm: The raw PCM audio data.
+        raw_pcm: memoryview of the raw PCM audio data, valid until this returns.
         channel: The Discord text channel to send the transcription to.
+        partials: Speculative transcripts of the beginning of the utterance.
+
+    Returns:
+        The task playing the reply, or None. It is not awaited here, so the
+        scheduler slot is freed as soon as the reply text is complete.
     """
 
-    try:
-        out_buffer = io.BytesIO()
-        with wave.open(out_buffer, 'wb') as wav_file:
-            wav_file.setnchannels(2)
-            wav_file.setsampwidth(2)
-            wav_file.setframerate(48000)
-            wav_file.writeframes(raw_pcm)
-        out_buffer.seek(0)
+    session = get_session(guild.id)
+    conversation_history = session.conversation_history
 
+    try:
         username = f"User {user_id}"
         member = guild.get_member(user_id)
         if member: username = member.display_name
 
-        if RUN_LOCALLY:
-            model = WhisperModel("large-v3-turbo", device="cuda", compute_type="float16")
-            async with model_lock:
-                def run_whisper():
-                    segments, info = model.transcribe(
-                        out_buffer, 
-                        beam_size=5, 
-                        language=LANGUAGE.lower(), 
-                        vad_filter=True,
-                        vad_parameters=dict(min_silence_duration_ms=500),
-                        initial_prompt=INITIAL_PROMPT if REQUIRE_TRIGGER else None 
-                    )
-                    return "".join([segment.text for segment in segments]).strip()
-        else:
-            def run_whisper():
-                transcription = groq.audio.transcriptions.create(
-                    file=("audio.wav", out_buffer.read()), 
-                    model="whisper-large-v3-turbo",
-                    prompt=INITIAL_PROMPT if REQUIRE_TRIGGER else None,
-                    temperature=0.0, 
-                    language=LANGUAGE.lower(), 
-                    response_format="json"
-                )
-                return transcription.text.strip()
-            
-        text = await bot.loop.run_in_executor(thread_pool, run_whisper)
+        if wake_word_cascade():
+            # The first speculative chunk already went through the cheap check
+            verdict = await speculative_verdict(partials) if partials else None
+            if verdict is False and partials[0][0] >= WAKE_WORD_WINDOW * BYTES_PER_SECOND:
+                print(f"Ignoring (wake word) | {cascade_stats.report()}")
+                return
+            if not verdict:
+                # No verdict, or the first chunk was shorter than the check's window
+                partials = ()
+                passed, head_text = await check_wake_word(raw_pcm)
+                if not passed:
+                    print(f"Ignoring (wake word): '{head_text}' | {cascade_stats.report()}")
+                    return
+
+        text = await finish_transcript(raw_pcm, partials)
 
         if text:
-            clean_text = text.lower().replace(",", "").replace(".", "").replace("?", "").strip()
+            clean_text = clean_transcript(text)
             if clean_text in IGNORED_PHRASES or len(clean_text) < 6: 
                 return
 
             if REQUIRE_TRIGGER:
-                is_triggered = any(trigger in clean_text for trigger in TRIGGERS)
+                is_triggered = contains_trigger(clean_text)
                 if not is_triggered:
                     print(f"Ignoring: '{text}'")
                     return 
@@ -268,120 +754,125 @@ async def process_transcription(guild, user_id, raw_pcm, channel):
                         embed = discord.Embed(description=f"{text}", color=discord.Color.green())
                         embed.set_author(name=username, icon_url=member.avatar.url if member else None)
                         await channel.send(embed=embed)
+
+                    intent = match_intent(clean_text)
+                    if intent:
+                        return await answer_intent(intent, guild, user_id, channel, text)
                     
-                    conversation_history.append({"role": "user", "content": text})
-
-                    def ask_groq():
-                        try:
-                            response = groq.chat.completions.create(
-                                messages=conversation_history,
-                                model="llama-3.3-70b-versatile",
-                                temperature=0.7, 
-                                max_completion_tokens=300, 
-                                stream=False,
-                                tools=tools_schema, 
-                                tool_choice="auto"
-                            )
-                        except BadRequestError as e:
-                            print(f"BadRequestError: {e}")
-                            response = groq.chat.completions.create(
-                                messages=conversation_history,
-                                model="llama-3.3-70b-versatile",
-                                temperature=0.7,
-                                max_completion_tokens=300,
-                                stream=False
-                            )
-                        response_message = response.choices[0].message
-                        tool_calls = response_message.tool_calls
-
-                        if tool_calls:
-                            conversation_history.append(response_message)
-                            for tool_call in tool_calls:
-                                if tool_call.function.name == "web_search":
-                                    try:
-                                        function_args = json.loads(tool_call.function.arguments)
-                                        query = function_args.get("query")
-                                        print(f"Searching: {query}")
-                                        raw_result = tavily_client.search(query, search_depth="basic", max_tokens=500)
-                                        search_result = json.dumps(raw_result, ensure_ascii=False)
-                                    except Exception as e:
-                                        search_result = f"Error: {e}"
-                                    
-                                    conversation_history.append({
-                                        "tool_call_id": tool_call.id, 
-                                        "role": "tool",
-                                        "name": "web_search",
-                                        "content": search_result,
-                                    })
-                                if tool_call.function.name == "current_time":
-                                    try:
-                                        print(f"Fetching current server time")
-                                        current_time_str = datetime.now(ZoneInfo(ZONE)).strftime("%Y-%m-%d %H:%M:%S")
-                                        raw_result = {
-                                            "status": "success",
-                                            "current_time": current_time_str,
-                                            "time_zone": ZONE
-                                        }
-                                        search_result = json.dumps(raw_result, ensure_ascii=False)
-                                    except Exception as e:
-                                        search_result = json.dumps({"error": str(e)})
-                                    
+                    text_queue = asyncio.Queue()
+                    spoken = []
+
+                    def emit(delta):
+                        # Text handed to TTS cannot be taken back, a retry continues after it
+                        spoken.append(delta)
+                        text_queue.put_nowait(delta)
+
+                    vc = guild.voice_client
+                    # Replies wait for the guild's playback_lock in the order they were created. The next
+                    # job of this user starts only after this one, so its reply is always played later.
+                    speaker = asyncio.create_task(speak_stream(vc, text_queue, user_id)) if vc else None
+
+                    try:
+                        async with session.turn_lock:
+                            conversation_history.append({"role": "user", "content": text})
+                            compact_history(conversation_history)
+
+                            async def ask_groq():
+                                try:
+                                    content, tool_calls = await stream_completion(
+                                        emit,
+                                        messages=conversation_history,
+                                        model="llama-3.3-70b-versatile",
+                                        temperature=0.7, 
+                                        max_completion_tokens=300, 
+                                        tools=tools_schema, 
+                                        tool_choice="auto"
+                                    )
+                                except APIError as e:
+                                    if not is_request_error(e):
+                                        raise
+                                    print(f"Completion Error: {e}")
+                                    # Prefill what was already spoken, so the answer goes on instead of starting over
+                                    prefix = "".join(spoken)
+                                    prefill = [{"role": "assistant", "content": prefix}] if prefix else []
+                                    content, tool_calls = await stream_completion(
+                                        emit,
+                                        messages=conversation_history + prefill,
+                                        model="llama-3.3-70b-versatile",
+                                        temperature=0.7,
+                                        max_completion_tokens=300
+                                    )
+                                    content = prefix + content
+
+                                if tool_calls:
                                     conversation_history.append({
-                                        "tool_call_id": tool_call.id, 
-                                        "role": "tool",
-                                        "name": "current_time",
-                                        "content": search_result,
+                                        "role": "assistant",
+                                        "content": content or None,
+                                        "tool_calls": tool_calls,
                                     })
+                                    tool_messages = await tool_executor.run_all(tool_calls)
+                                    conversation_history.extend(tool_messages)
                             
+                                    try:
+                                        final_content, _ = await stream_completion(
+                                            emit,
+                                            stage="llm_final",
+                                            messages=conversation_history,
+                                            model="llama-3.3-70b-versatile",
+                                            temperature=0.7,
+                                            tools=tools_schema,
+                                            tool_choice="none"
+                                        )
+                                        return final_content
+                                    except APIError as e:
+                                        if not is_request_error(e):
+                                            raise
+                                        print(f"Completion Error Step 2: {e}")
+                                        emit("Error generating final response.")
+                                        return "Error generating final response."
+                                else:
+                                    return content
+
                             try:
-                                final_response = groq.chat.completions.create(
-                                    messages=conversation_history,
-                                    model="llama-3.3-70b-versatile",
-                                    temperature=0.7,
-                                    tools=tools_schema,
-                                    tool_choice="none"
-                                )
-                                return final_response.choices[0].message.content or ""
-                            except BadRequestError as e:
-                                print(f"BadRequestError Step 2: {e}")
-                                return "Error generating final response."
-                        else:
-                            return response_message.content or ""
-                    
-                    try:
-                        response_text = await bot.loop.run_in_executor(thread_pool, ask_groq)
+                                response_text = await ask_groq()
+                            finally:
+                                text_queue.put_nowait(None)
                         
-                        if not response_text:
-                            print("Response text is empty or None.")
-                            return
-
-                        conversation_history.append({"role": "assistant", "content": response_text})
-                        if len(conversation_history) > 15: 
-                            del conversation_history[1:4]
-
-                        vc = guild.voice_client
-                        if vc:
-                            clean_tts = response_text.replace("**", "").replace("*", "")
-                            await speak_response(vc, clean_tts)
-
-                        if LOGGING:
-                            embed = discord.Embed(description=response_text, color=discord.Color.red())
-                            embed.set_author(name=bot.user.name, icon_url=bot.user.avatar.url if member else None)
-                            await channel.send(embed=embed)
+                            if not response_text:
+                                print("Response text is empty or None.")
+                                return speaker
+
+                            conversation_history.append({"role": "assistant", "content": response_text})
+                            compact_history(conversation_history)
+                            await session.save_history()
+
+                            if LOGGING:
+                                embed = discord.Embed(description=response_text, color=discord.Color.red())
+                                embed.set_author(name=bot.user.name, icon_url=bot.user.avatar.url if member else None)
+                                await channel.send(embed=embed)
                         
                     except Exception as e:
                         print(f"LLM Error: {e}")
                         import traceback
                         traceback.print_exc()
+                    finally:
+                        text_queue.put_nowait(None)
+                    return speaker
                 else:
                     print(f"No permission in {channel.name}")
     except Exception as e:
         print(f"Transcription error: {e}")
 
 
+scheduler = UtteranceScheduler(process_transcription)
+register_gauge("queued_utterances", lambda: scheduler.stats()["queued"])
+register_gauge("in_flight_utterances", lambda: scheduler.stats()["in_flight"])
+register_gauge("audio_buffers_allocated", lambda: buffer_pool.allocated)
+
+
 def play_keep_alive(vc):
     """
-    Plays a silent audio stream to keep the bot's audio connection alive.
+    Plays endless in-process silence to keep the bot's audio connection alive.
 
     Args:
         vc: The voice client.
@@ -389,19 +880,14 @@ def play_keep_alive(vc):
     if not vc.is_connected():
         return
     
-    if IS_SPEAKING: 
+    if get_session(vc.guild.id).is_speaking: 
         return
     
     if vc.is_playing(): 
         return
 
-    source = discord.FFmpegPCMAudio(
-        "https://github.com/anars/blank-audio/raw/master/1-minute-of-silence.mp3",
-        before_options="-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
-    )
-
     try:
-        vc.play(source, after=lambda e: play_keep_alive(vc))
+        vc.play(SilenceSource())
     except discord.ClientException:
         pass
     except Exception as e:
@@ -428,20 +914,58 @@ async def join(ctx):
     else:
         vc = await dest.connect()
     
-    try:
-        play_keep_alive(vc)
-    except Exception as e:
-        print(f"FFmpeg not found - Keep-Alive inactive. The bot may go deaf after a minute of silence. (Error: {e})")
+    play_keep_alive(vc)
 
     await ctx.respond(f"Connected to **{dest.name}**.")
+    session = get_session(ctx.guild.id)
+    await session.restore()
     if not vc.recording:
+        session.sink = make_sink(session, ctx.channel)
         vc.start_recording(
-            AutoCutSink(ctx.channel), 
+            session.sink, 
             finished_callback, 
             ctx.channel
         )
 
-    bot_controllers[ctx.guild.id] = ctx.author.id
+    await session.set_controller(ctx.author.id)
+
+
+def close_session(guild_id):
+    """
+    Releases a guild's voice state and drops its queued utterances after the bot leaves.
+
+    Args:
+        guild_id: The Discord guild ID.
+    """
+    get_session(guild_id).close()
+    scheduler.drop_guild(guild_id)
+
+
+@bot.slash_command(name="queue")
+async def queue(ctx):
+    """
+    Shows the utterance queue depth and wait times after the /queue command.
+
+    Args:
+        ctx: The command context.
+    """
+    stats = scheduler.stats()
+    await ctx.respond(
+        f"Queued: **{stats['queued']}** | In flight: **{stats['in_flight']}/{stats['max_in_flight']}** | Playing: **{stats['playing']}**\n"
+        f"Wait: avg **{stats['avg_wait']:.2f}s**, max **{stats['max_wait']:.2f}s**\n"
+        f"Processed: {stats['processed']} | Merged: {stats['merged']} | Dropped: {stats['dropped']}"
+    )
+
+
+@bot.slash_command(name="stats")
+async def stats(ctx):
+    """
+    Shows p50/p95/p99 latency of each pipeline stage after the /stats command.
+
+    Args:
+        ctx: The command context.
+    """
+    await ctx.respond(f"```\n{render_table()}\n\n{startup_report.render()}\n```")
 
 
 @bot.slash_command(name="stop")
@@ -454,6 +978,7 @@ async def stop(ctx):
     """
     if ctx.guild.voice_client:
         await ctx.guild.voice_client.disconnect()
+        close_session(ctx.guild.id)
         await ctx.respond("Disconnected.")
         print("Bot disconnected.")
 
@@ -474,13 +999,15 @@ async def on_voice_state_update(member, before, after):
     if not vc: 
         return
     
-    controller_id = bot_controllers.get(member.guild.id)
+    session = get_session(member.guild.id)
+    controller_id = session.controller_id
 
     if member.id != controller_id: 
         return
 
     if len(vc.channel.members) == 1:
         await vc.disconnect()
+        close_session(member.guild.id)
         return
 
     if before.channel and before.channel.id == vc.channel.id:
@@ -489,8 +1016,63 @@ async def on_voice_state_update(member, before, after):
                 await vc.move_to(after.channel)
         else:
             await vc.disconnect()
-            if member.guild.id in bot_controllers:
-                del bot_controllers[member.guild.id]
+            close_session(member.guild.id)
+            await session.set_controller(None)
+
+
+async def load_command_ids():
+    """
+    Maps the slash commands registered by the shard 0 process to their IDs, without
+    registering anything. Interactions are matched to commands by these IDs.
+
+    Returns:
+        The number of commands whose ID was not known before.
+    """
+    if COMMAND_GUILDS:
+        registered = []
+        for guild_id in COMMAND_GUILDS:
+            registered.extend(await bot.http.get_guild_commands(bot.application_id, guild_id))
+    else:
+        registered = await bot.http.get_global_commands(bot.application_id)
+
+    added = 0
+    for data in registered:
+        command = discord.utils.get(bot.pending_application_commands, name=data["name"], type=data.get("type"))
+        if command and data["id"] not in bot._application_commands:
+            command.id = data["id"]
+            bot._application_commands[command.id] = command
+            added += 1
+    return added
+
+
+@bot.event
+async def on_connect():
+    """
+    Function called when the bot connects. The process running shard 0 (or the only
+    process) syncs the slash commands, the other shard processes only load their IDs.
+    """
+    try:
+        if bot.auto_sync_commands:
+            await bot.sync_commands()
+        else:
+            await load_command_ids()
+    except Exception as e:
+        print(f"Command Sync Error: {e}")
+
+
+@bot.event
+async def on_unknown_application_command(interaction):
+    """
+    Retries an interaction once if its command was registered by shard 0 after
+    this process loaded the command IDs.
+
+    Args:
+        interaction: The interaction with an unknown command ID.
+    """
+    if bot.auto_sync_commands or not interaction.data:
+        return
+    if await load_command_ids() and interaction.data["id"] in bot._application_commands:
+        await bot.process_application_commands(interaction)
 
 
 @bot.event
@@ -499,7 +1081,36 @@ async def on_ready():
     Function called when the bot is ready.
     """
     print(f"{bot.user} is online!")
-    if not check_silence_task.is_running(): check_silence_task.start()
+    if METRICS_PORT and not getattr(bot, "metrics_server", None):
+        bot.metrics_server = await start_metrics_server()
+
+    # on_ready also fires after reconnects, warm up only once
+    if "login" not in startup_report.phases:
+        startup_report.mark("login")
+        bot.loop.create_task(warm_up())
+
+
+async def warm_up():
+    """
+    Opens the Groq, Tavily and TTS connections in the background,
+    so the first request does not pay for the TLS handshakes.
+    """
+    await asyncio.gather(warm_up_connections(), warm_up_tts())
+    startup_report.mark("warm_up")
+    print(startup_report.render())
+
+
+if __name__ == "__main__":
+    if RUN_LOCALLY:
+        if stt_workers:
+            stt_workers.start()
+        else:
+            load_whisper_model()
 
+    # Without the cascade a Groq-only setup never imports faster-whisper,
+    # with STT workers the wake-word model is loaded in the workers
+    if wake_word_cascade() and not stt_workers:
+        load_wake_word_model()
+    startup_report.mark("models")
 
-bot.run(BOT_TOKEN)
\ No newline at end of file
+    bot.run(BOT_TOKEN)
\ No newline at end of file
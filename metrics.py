@@ -0,0 +1,291 @@
+import json
+import time
+import uuid
+import asyncio
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from config import *
+
+
+class Histogram:
+    """
+    Latency histogram over a window of the most recent observations.
+    """
+
+    def __init__(self, window=1000):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.values.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Returns the q-quantile (0..1) of the recent observations.
+        """
+        if not self.values:
+            return 0.0
+        ordered = sorted(self.values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+histograms = {}
+gauges = {}
+# Number of utterances per outcome: processed, merged into a waiting one, or dropped unprocessed
+outcomes = {}
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def observe(stage, seconds):
+    """
+    Records one duration of a pipeline stage.
+
+    Args:
+        stage: Stage name, e.g. "stt" or "llm".
+        seconds: Duration in seconds.
+    """
+    histogram = histograms.get(stage)
+    if histogram is None:
+        histogram = histograms[stage] = Histogram()
+    histogram.observe(seconds)
+
+
+def register_gauge(name, func):
+    """
+    Adds a value that is read on every metrics scrape.
+
+    Args:
+        name: Metric name.
+        func: Callable returning the current value.
+    """
+    gauges[name] = func
+
+
+class Trace:
+    """
+    Timing spans of one utterance, from the end of speech to the end of the reply,
+    tied together by a request id.
+    """
+
+    def __init__(self, guild_id, user_id, start=None):
+        self.request_id = uuid.uuid4().hex[:8]
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.start = start or time.monotonic()
+        self.spans = []
+
+    def add(self, stage, seconds):
+        """
+        Adds a finished span and records it in the stage histogram.
+        """
+        self.spans.append((stage, seconds))
+        observe(stage, seconds)
+
+    def mark(self, stage):
+        """
+        Records the time elapsed since the end of speech.
+        """
+        self.add(stage, time.monotonic() - self.start)
+
+    def finish(self, outcome="processed"):
+        """
+        Counts the outcome and writes the trace to TRACE_LOG_FILE if enabled.
+        Only processed utterances add to the total latency.
+
+        Args:
+            outcome: "processed", "merged" (absorbed by the waiting utterance of
+                the same user) or "dropped" (stale or over the queue limit).
+        """
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        if outcome == "processed":
+            self.mark("total")
+            startup_report.request_finished(self)
+        if TRACE_LOG_FILE:
+            entry = {
+                "request_id": self.request_id,
+                "guild_id": self.guild_id,
+                "user_id": self.user_id,
+                "outcome": outcome,
+                "time": time.time(),
+                "spans": {stage: round(seconds, 4) for stage, seconds in self.spans},
+            }
+            try:
+                with open(TRACE_LOG_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+            except OSError as e:
+                print(f"Trace Log Error: {e}")
+
+
+class StartupReport:
+    """
+    Durations of the startup phases (imports, models, login, warm-up) and the
+    stage timings of the first request, so cold-start regressions show up.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.last_mark = self.started
+        self.phases = {}
+        self.first_request = None
+
+    def start(self, started):
+        """
+        Sets the process start time, measured before the first heavy import.
+        """
+        self.started = self.last_mark = started
+
+    def mark(self, phase):
+        """
+        Records the time since the previous phase ended.
+        """
+        now = time.monotonic()
+        self.phases[phase] = now - self.last_mark
+        self.last_mark = now
+
+    def request_finished(self, trace):
+        """
+        Keeps the spans of the first finished request and prints the report.
+        """
+        if self.first_request is None:
+            self.first_request = list(trace.spans)
+            print(self.render())
+
+    def render(self):
+        """
+        Returns the report as plain text.
+        """
+        lines = ["Startup: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases.items())]
+        if self.first_request:
+            lines.append("First request: " + ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in self.first_request))
+        return "\n".join(lines)
+
+
+startup_report = StartupReport()
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def record(stage, seconds):
+    """
+    Adds a duration to the current trace, or only to the stage histogram if there is no trace.
+
+    Args:
+        stage: Stage name.
+        seconds: Duration in seconds.
+    """
+    trace = current_trace.get()
+    if trace:
+        trace.add(stage, seconds)
+    else:
+        observe(stage, seconds)
+
+
+@contextmanager
+def span(stage):
+    """
+    Times a block as a stage of the current trace. Without a trace
+    the duration still goes to the stage histogram.
+
+    Args:
+        stage: Stage name.
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record(stage, time.monotonic() - start)
+
+
+def mark(stage):
+    """
+    Records the time since the end of speech in the current trace, if there is one.
+
+    Args:
+        stage: Stage name.
+    """
+    trace = current_trace.get()
+    if trace:
+        trace.mark(stage)
+
+
+def render_prometheus():
+    """
+    Renders all histograms and gauges in the Prometheus text format.
+
+    Returns:
+        The metrics page as a string.
+    """
+    lines = [
+        "# HELP jarvis_stage_seconds Latency of each pipeline stage.",
+        "# TYPE jarvis_stage_seconds summary",
+    ]
+    for stage, histogram in sorted(histograms.items()):
+        for q in QUANTILES:
+            lines.append(f'jarvis_stage_seconds{{stage="{stage}",quantile="{q}"}} {histogram.quantile(q):.6f}')
+        lines.append(f'jarvis_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+        lines.append(f'jarvis_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+    lines.append("# HELP jarvis_utterances_total Utterances by outcome.")
+    lines.append("# TYPE jarvis_utterances_total counter")
+    for outcome, count in sorted(outcomes.items()):
+        lines.append(f'jarvis_utterances_total{{outcome="{outcome}"}} {count}')
+
+    for name, func in sorted(gauges.items()):
+        lines.append(f"# TYPE jarvis_{name} gauge")
+        lines.append(f"jarvis_{name} {func()}")
+    return "\n".join(lines) + "\n"
+
+
+def render_table():
+    """
+    Renders p50/p95/p99 per stage as a plain text table.
+
+    Returns:
+        The table as a string.
+    """
+    lines = [f"{'stage':<20} {'p50':>8} {'p95':>8} {'p99':>8} {'count':>7}"]
+    for stage, histogram in sorted(histograms.items()):
+        p50, p95, p99 = (histogram.quantile(q) * 1000 for q in QUANTILES)
+        lines.append(f"{stage:<20} {p50:>6.0f}ms {p95:>6.0f}ms {p99:>6.0f}ms {histogram.count:>7}")
+    return "\n".join(lines)
+
+
+async def _handle_http(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+
+        path = request_line.split()[1].decode() if len(request_line.split()) > 1 else "/"
+        if path == "/metrics":
+            status, body = "200 OK", render_prometheus()
+        else:
+            status, body = "404 Not Found", "Not Found\n"
+
+        data = body.encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+    except Exception as e:
+        print(f"Metrics Server Error: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server():
+    """
+    Serves /metrics on 127.0.0.1:METRICS_PORT. Does nothing if METRICS_PORT is 0.
+
+    Returns:
+        The asyncio server or None.
+    """
+    if not METRICS_PORT:
+        return None
+    server = await asyncio.start_server(_handle_http, "127.0.0.1", METRICS_PORT)
+    print(f"Metrics available at http://127.0.0.1:{METRICS_PORT}/metrics")
+    return server
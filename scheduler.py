@@ -0,0 +1,190 @@
+import time
+import asyncio
+from collections import deque
+from config import *
+from audio import BYTES_PER_SECOND
+from metrics import current_trace
+
+
+class Job:
+    """
+    One finished utterance waiting to be processed.
+    """
+
+    def __init__(self, guild, user_id, audio_data, channel, priority=False, urgent=False, trace=None, partials=()):
+        self.guild = guild
+        self.user_id = user_id
+        self.audio_data = audio_data
+        self.channel = channel
+        self.priority = priority
+        # Started even when all slots are taken, e.g. a possible "stop" during the user's own reply
+        self.urgent = urgent
+        self.trace = trace
+        self.partials = partials
+        self.enqueued_at = time.monotonic()
+        self.updated_at = self.enqueued_at
+
+    @property
+    def key(self):
+        return (self.guild.id, self.user_id)
+
+    def release(self, outcome=None):
+        """
+        Returns the audio buffer to its pool once the job is done or dropped,
+        and stops its speculative transcripts that are still running.
+
+        Args:
+            outcome: Finishes the trace with this outcome ("merged" or "dropped"),
+                for jobs that never run. Processed jobs finish it after the reply.
+        """
+        self.audio_data.release()
+        for _, task in self.partials:
+            task.cancel()
+        if outcome and self.trace:
+            self.trace.finish(outcome)
+
+
+class UtteranceScheduler:
+    """
+    Schedules utterances with per-user FIFO queues and a global cap on jobs in flight.
+    Each user has at most one job running, so their replies stay in order.
+    A job only holds its slot until the reply text is complete: the handler may
+    return the task that plays the reply, which keeps running outside the cap,
+    so guilds that are reading out replies never hold up STT and LLM work of others.
+    The session controller is served first, utterances queued behind a waiting one
+    of the same user are merged into it, and utterances that waited too long are dropped.
+    """
+
+    def __init__(self, handler, max_in_flight=None, max_queued_per_user=None, stale_after=None):
+        self.handler = handler
+        self.max_in_flight = max_in_flight or MAX_IN_FLIGHT_UTTERANCES
+        self.max_queued_per_user = max_queued_per_user or MAX_QUEUED_PER_USER
+        self.stale_after = stale_after or STALE_UTTERANCE_SECONDS
+        self.queues = {}
+        self.running = set()
+        self.tasks = set()
+        self.replies = set()
+        self.waits = deque(maxlen=100)
+        self.processed = 0
+        self.merged = 0
+        self.dropped = 0
+
+    def submit(self, job):
+        """
+        Queues a finished utterance and starts it if there is capacity.
+
+        Args:
+            job: The Job to schedule.
+        """
+        queue = self.queues.setdefault(job.key, deque())
+        waiting = queue[-1] if queue else None
+
+        if (waiting and len(waiting.audio_data) + len(job.audio_data) <= MAX_MERGED_AUDIO_SECONDS * BYTES_PER_SECOND
+                and len(job.audio_data) <= waiting.audio_data.free()):
+            # The user kept talking while waiting, process it as one utterance
+            waiting.audio_data.append(job.audio_data.view())
+            job.release("merged")
+            waiting.updated_at = job.updated_at
+            waiting.priority = waiting.priority or job.priority
+            waiting.urgent = waiting.urgent or job.urgent
+            self.merged += 1
+        else:
+            queue.append(job)
+            while len(queue) > self.max_queued_per_user:
+                queue.popleft().release("dropped")
+                self.dropped += 1
+
+        self._dispatch()
+
+    def _next_job(self, urgent_only=False):
+        now = time.monotonic()
+        best = None
+
+        for key, queue in list(self.queues.items()):
+            while queue and now - queue[0].updated_at > self.stale_after:
+                queue.popleft().release("dropped")
+                self.dropped += 1
+            if not queue:
+                del self.queues[key]
+                continue
+            if key in self.running:
+                continue
+
+            candidate = queue[0]
+            if urgent_only and not candidate.urgent:
+                continue
+            if best is None or (candidate.urgent, candidate.priority, -candidate.enqueued_at) > (best.urgent, best.priority, -best.enqueued_at):
+                best = candidate
+
+        if best:
+            self.queues[best.key].popleft()
+        return best
+
+    def _dispatch(self):
+        while True:
+            job = self._next_job(urgent_only=len(self.running) >= self.max_in_flight)
+            if job is None:
+                return
+
+            self.running.add(job.key)
+            wait = time.monotonic() - job.enqueued_at
+            self.waits.append(wait)
+            if job.trace:
+                job.trace.add("queue_wait", wait)
+            task = asyncio.create_task(self._run(job))
+            self.tasks.add(task)
+
+    async def _run(self, job):
+        # Stages recorded anywhere below (STT, LLM, tools, TTS) land in this job's trace
+        current_trace.set(job.trace)
+        reply = None
+        try:
+            reply = await self.handler(job.guild, job.user_id, job.audio_data.view(), job.channel, job.partials)
+        except Exception as e:
+            print(f"Scheduler Error: {e}")
+        finally:
+            job.release()
+            if reply:
+                self.replies.add(reply)
+                reply.add_done_callback(lambda task: self._reply_done(task, job))
+            elif job.trace:
+                job.trace.finish()
+            self.processed += 1
+            self.running.discard(job.key)
+            self.tasks.discard(asyncio.current_task())
+            self._dispatch()
+
+    def _reply_done(self, task, job):
+        # The trace covers the whole reply, up to the end of playback
+        self.replies.discard(task)
+        if job.trace:
+            job.trace.finish()
+
+    def drop_guild(self, guild_id):
+        """
+        Drops all queued (not yet started) utterances of a guild.
+
+        Args:
+            guild_id: The Discord guild ID.
+        """
+        for key in [key for key in self.queues if key[0] == guild_id]:
+            for job in self.queues.pop(key):
+                job.release("dropped")
+                self.dropped += 1
+
+    def stats(self):
+        """
+        Returns the current queue depth, jobs in flight and recent wait times.
+        """
+        waits = sorted(self.waits)
+        return {
+            "queued": sum(len(queue) for queue in self.queues.values()),
+            "in_flight": len(self.running),
+            "max_in_flight": self.max_in_flight,
+            "playing": len(self.replies),
+            "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+            "max_wait": waits[-1] if waits else 0.0,
+            "processed": self.processed,
+            "merged": self.merged,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,93 @@
+import asyncio
+from config import *
+from store import state_store
+
+
+class GuildSession:
+    """
+    Per-guild state: conversation history, TTS speaking state, the active sink
+    and the locks that keep conversation turns and playback in order.
+    Each guild gets its own session, so guilds never block or overhear each other.
+    The conversation and controller are restored from the state store on the first
+    /join, so they survive restarts and moving the guild to another shard process.
+    """
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.conversation_history = [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            }
+        ]
+        self.restored = False
+        # The user who started the session, cached here for the voice callbacks
+        self.controller_id = None
+        self.is_speaking = False
+        # Set when a user talks over the reply, the rest of it is skipped
+        self.interrupted = False
+        # Reply tasks that are playing or waiting to play, and the user the current one answers
+        self.replies = set()
+        self.replying_to = None
+        self.sink = None
+        # One conversation turn at a time, so tool calls and replies are never interleaved
+        self.turn_lock = asyncio.Lock()
+        # One reply is played at a time
+        self.playback_lock = asyncio.Lock()
+
+    async def restore(self):
+        """
+        Loads the saved conversation and controller from the state store, once per process.
+        """
+        if self.restored:
+            return
+        self.restored = True
+        self.conversation_history[1:] = await state_store.load_history(self.guild_id) or []
+        self.controller_id = await state_store.get_controller(self.guild_id)
+
+    async def set_controller(self, user_id):
+        """
+        Sets the user who controls the session, None when the session ends.
+        """
+        self.controller_id = user_id
+        if user_id is None:
+            await state_store.remove_controller(self.guild_id)
+        else:
+            await state_store.set_controller(self.guild_id, user_id)
+
+    async def save_history(self):
+        """
+        Saves the conversation to the state store, without the system prompt,
+        so a changed SYSTEM_PROMPT applies to restored conversations too.
+        """
+        await state_store.save_history(self.guild_id, self.conversation_history[1:])
+
+    def close(self):
+        """
+        Called when the bot leaves the guild's voice channel.
+        Releases the sink, the conversation history is kept for the next /join.
+        """
+        self.sink = None
+        self.is_speaking = False
+        self.interrupted = False
+        self.replying_to = None
+
+
+guild_sessions = {}
+
+
+def get_session(guild_id):
+    """
+    Returns the session of a guild, creating it on first use.
+
+    Args:
+        guild_id: The Discord guild ID.
+
+    Returns:
+        The GuildSession for that guild.
+    """
+    session = guild_sessions.get(guild_id)
+    if session is None:
+        session = GuildSession(guild_id)
+        guild_sessions[guild_id] = session
+    return session
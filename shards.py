@@ -0,0 +1,76 @@
+"""
+Runs the bot as several processes on one machine. The guilds are split into
+shards by Discord and every process connects its own part of the shards, so
+the voice channels are spread over several cores. Controllers and
+conversation history are shared through a SQLite state store, so a guild
+keeps them when it moves to another process (e.g. after changing --processes).
+
+A process that exits is started again after a few seconds.
+
+Usage:
+    python shards.py --processes 2 [--shards 4] [--state jarvis_state.db]
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+
+def assign_shards(shard_count, processes):
+    """
+    Splits the shard IDs evenly between the processes.
+
+    Returns:
+        A list with the shard IDs of each process.
+    """
+    return [list(range(shard_count))[i::processes] for i in range(processes)]
+
+
+def start_process(index, shard_ids, args):
+    """
+    Starts main.py for one group of shards.
+    """
+    env = dict(os.environ)
+    env["SHARD_COUNT"] = str(args.shards)
+    env["SHARD_IDS"] = ",".join(str(shard_id) for shard_id in shard_ids)
+    env["STATE_STORE"] = args.state
+    if args.metrics_port:
+        env["METRICS_PORT"] = str(args.metrics_port + index)
+
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    return subprocess.Popen([sys.executable, main], env=env)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--shards", type=int, help="total number of shards, one per process by default")
+    parser.add_argument("--state", default="jarvis_state.db", help="SQLite file shared by all processes")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("METRICS_PORT", "0")),
+                        help="first metrics port, process i serves on port + i")
+    parser.add_argument("--restart-delay", type=float, default=5.0)
+    args = parser.parse_args()
+    args.shards = args.shards or args.processes
+
+    if args.state == "memory":
+        parser.error("--state must be a SQLite file, in-memory state is not shared between processes")
+    if args.shards < args.processes:
+        parser.error("--shards must be at least --processes")
+
+    groups = assign_shards(args.shards, args.processes)
+    processes = [start_process(i, shard_ids, args) for i, shard_ids in enumerate(groups)]
+
+    try:
+        while True:
+            time.sleep(1)
+            for i, process in enumerate(processes):
+                if process.poll() is not None:
+                    print(f"Shard process {i} (shards {groups[i]}) exited with code {process.returncode}, restarting")
+                    time.sleep(args.restart_delay)
+                    processes[i] = start_process(i, groups[i], args)
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
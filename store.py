@@ -0,0 +1,131 @@
+import json
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from config import *
+
+
+class MemoryStore:
+    """
+    Session controllers and conversation history of each guild, kept in this process.
+    Enough for a single process; the state is lost on restart.
+    The methods are coroutines, so stores backed by I/O never block the event loop.
+    """
+
+    def __init__(self):
+        self.controllers = {}
+        self.histories = {}
+
+    async def get_controller(self, guild_id):
+        """
+        Returns the ID of the user who started the session in a guild, or None.
+        """
+        return self.controllers.get(guild_id)
+
+    async def set_controller(self, guild_id, user_id):
+        self.controllers[guild_id] = user_id
+
+    async def remove_controller(self, guild_id):
+        self.controllers.pop(guild_id, None)
+
+    async def load_history(self, guild_id):
+        """
+        Returns the saved conversation of a guild without the system prompt, or None.
+        """
+        history = self.histories.get(guild_id)
+        return list(history) if history is not None else None
+
+    async def save_history(self, guild_id, messages):
+        """
+        Saves the conversation of a guild.
+
+        Args:
+            guild_id: The Discord guild ID.
+            messages: The chat messages without the system prompt.
+        """
+        self.histories[guild_id] = list(messages)
+
+
+class SQLiteStore(MemoryStore):
+    """
+    Session controllers and conversation history in a SQLite file. Several bot
+    processes can share the file, so when a guild's shard moves to another
+    process, its controller and conversation move with it.
+
+    Every read goes to the database: a guild only ever belongs to one process
+    at a time, but it may have been served by another one since the last read.
+    Queries run on the store's own thread, waiting for a lock held by another
+    process (up to the 5 s busy timeout) never blocks the event loop.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        # One thread owns all queries, so they never overlap on the shared connection
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+        self.connection = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        # WAL lets the other processes read while one of them writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS controllers (guild_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS histories (guild_id INTEGER PRIMARY KEY, messages TEXT NOT NULL)"
+        )
+
+    def _fetch(self, query, guild_id):
+        try:
+            row = self.connection.execute(query, (guild_id,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"State Store Error: {e}")
+            return None
+        return row[0] if row else None
+
+    def _execute(self, query, params):
+        try:
+            self.connection.execute(query, params)
+        except sqlite3.Error as e:
+            print(f"State Store Error: {e}")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def get_controller(self, guild_id):
+        return await self._run(self._fetch, "SELECT user_id FROM controllers WHERE guild_id = ?", guild_id)
+
+    async def set_controller(self, guild_id, user_id):
+        await self._run(self._execute, "INSERT OR REPLACE INTO controllers (guild_id, user_id) VALUES (?, ?)", (guild_id, user_id))
+
+    async def remove_controller(self, guild_id):
+        await self._run(self._execute, "DELETE FROM controllers WHERE guild_id = ?", (guild_id,))
+
+    async def load_history(self, guild_id):
+        messages = await self._run(self._fetch, "SELECT messages FROM histories WHERE guild_id = ?", guild_id)
+        return json.loads(messages) if messages else None
+
+    async def save_history(self, guild_id, messages):
+        await self._run(
+            self._execute,
+            "INSERT OR REPLACE INTO histories (guild_id, messages) VALUES (?, ?)",
+            (guild_id, json.dumps(messages, ensure_ascii=False))
+        )
+
+
+def create_store(location=None):
+    """
+    Creates the state store configured by STATE_STORE.
+
+    Args:
+        location: "memory" or a path to a SQLite file, STATE_STORE by default.
+
+    Returns:
+        A MemoryStore or SQLiteStore.
+    """
+    location = location or STATE_STORE
+    if location == "memory":
+        return MemoryStore()
+    return SQLiteStore(location)
+
+
+state_store = create_store()
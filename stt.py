@@ -0,0 +1,397 @@
+import asyncio
+import difflib
+import threading
+import time
+from bisect import bisect_right
+import numpy as np
+from config import *
+from audio import BYTES_PER_SECOND, WHISPER_SAMPLE_RATE, pcm_to_whisper_audio
+
+
+_whisper_model = None
+_whisper_load_lock = threading.Lock()
+
+
+def load_whisper_model():
+    """
+    Loads the local Whisper model once per process and runs a warm-up pass.
+    Subsequent calls return the already loaded instance.
+
+    Returns:
+        The shared WhisperModel instance.
+    """
+    global _whisper_model
+
+    with _whisper_load_lock:
+        if _whisper_model is not None:
+            return _whisper_model
+
+        # Imported on first use, so a Groq-only setup never loads faster-whisper
+        from faster_whisper import WhisperModel
+
+        print(f"Loading Whisper model '{WHISPER_MODEL}' ({WHISPER_DEVICE}, {WHISPER_COMPUTE_TYPE})...")
+        start = time.perf_counter()
+        model = WhisperModel(
+            WHISPER_MODEL,
+            device=WHISPER_DEVICE,
+            compute_type=WHISPER_COMPUTE_TYPE,
+            cpu_threads=WHISPER_CPU_THREADS
+        )
+        print(f"Whisper model loaded in {time.perf_counter() - start:.2f}s")
+
+        warm_up_whisper(model)
+        _whisper_model = model
+        return _whisper_model
+
+
+def warm_up_whisper(model):
+    """
+    Runs a short transcription on one second of silence so the first real
+    utterance does not pay for kernel initialization and memory allocation.
+
+    Args:
+        model: The WhisperModel to warm up.
+    """
+    start = time.perf_counter()
+    try:
+        silence = np.zeros(16000, dtype=np.float32)
+        segments, info = model.transcribe(silence, beam_size=1, language=LANGUAGE.lower())
+        # Segments are generated lazily, consume them to actually run the decoder
+        for _ in segments:
+            pass
+        print(f"Whisper warm-up finished in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        print(f"Whisper Warm-up Error: {e}")
+
+
+def get_whisper_model():
+    """
+    Returns the shared local Whisper model, loading it on first use.
+
+    Returns:
+        The shared WhisperModel instance.
+    """
+    if _whisper_model is None:
+        return load_whisper_model()
+    return _whisper_model
+
+
+_batched_pipeline = None
+
+
+def get_batched_pipeline():
+    """
+    Returns the batched inference pipeline around the shared local Whisper model.
+    """
+    global _batched_pipeline
+    if _batched_pipeline is None:
+        from faster_whisper import BatchedInferencePipeline
+        _batched_pipeline = BatchedInferencePipeline(model=get_whisper_model())
+    return _batched_pipeline
+
+
+def trim_to_speech(audio):
+    """
+    Keeps only the speech of an utterance, found with the Silero VAD that faster-whisper
+    uses for vad_filter. Both transcribe_local and transcribe_batch use it, so an
+    utterance is handled the same way whether it is batched with others or not.
+
+    Args:
+        audio: 16 kHz mono float32 audio.
+
+    Returns:
+        The speech regions laid end to end, empty if there is no speech.
+    """
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    chunks = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=500))
+    if not chunks:
+        return audio[:0]
+    return np.concatenate([audio[chunk["start"]:chunk["end"]] for chunk in chunks])
+
+
+def _decode_options():
+    """
+    Returns the decoding options shared by the single and the batched path.
+    """
+    return dict(
+        beam_size=5,
+        language=LANGUAGE.lower(),
+        without_timestamps=True,
+        initial_prompt=INITIAL_PROMPT if REQUIRE_TRIGGER else None
+    )
+
+
+def transcribe_local(raw_pcm):
+    """
+    Transcribes one utterance with the local Whisper model.
+
+    Args:
+        raw_pcm: Raw PCM of the utterance (48 kHz stereo int16).
+
+    Returns:
+        The transcribed text.
+    """
+    audio = trim_to_speech(pcm_to_whisper_audio(raw_pcm))
+    if not len(audio):
+        return ""
+    segments, info = get_whisper_model().transcribe(audio, **_decode_options())
+    return "".join(segment.text for segment in segments).strip()
+
+
+def transcribe_batch(raw_pcms):
+    """
+    Transcribes several utterances in one batched forward pass. Each utterance is
+    trimmed to its speech, the results are laid end to end and each one is passed
+    as its own clip, so every clip becomes one element of the batch. Utterances
+    without speech are skipped and a single remaining one uses transcribe_local.
+
+    Args:
+        raw_pcms: Raw PCM of each utterance (48 kHz stereo int16, up to 30 s each).
+
+    Returns:
+        The transcribed texts in the same order.
+    """
+    if len(raw_pcms) == 1:
+        return [transcribe_local(raw_pcms[0])]
+
+    audios = [trim_to_speech(pcm_to_whisper_audio(raw_pcm)) for raw_pcm in raw_pcms]
+    speech = [i for i, audio in enumerate(audios) if len(audio)]
+    texts = [[] for _ in audios]
+    if len(speech) == 1:
+        segments, info = get_whisper_model().transcribe(audios[speech[0]], **_decode_options())
+        texts[speech[0]] = [segment.text for segment in segments]
+    elif speech:
+        starts = []
+        clips = []
+        offset = 0
+        for i in speech:
+            starts.append(offset / WHISPER_SAMPLE_RATE)
+            clips.append({"start": offset / WHISPER_SAMPLE_RATE, "end": (offset + len(audios[i])) / WHISPER_SAMPLE_RATE})
+            offset += len(audios[i])
+
+        segments, info = get_batched_pipeline().transcribe(
+            np.concatenate([audios[i] for i in speech]),
+            clip_timestamps=clips,
+            batch_size=len(speech),
+            vad_filter=False,
+            **_decode_options()
+        )
+        for segment in segments:
+            # Segments start at the offset of the clip they belong to
+            texts[speech[bisect_right(starts, segment.start + 0.01) - 1]].append(segment.text)
+    return ["".join(text).strip() for text in texts]
+
+
+class TranscriptionBatcher:
+    """
+    Micro-batching stage of the local path. Utterances that become ready within
+    STT_BATCH_WINDOW of the first waiting one, or while all model slots were busy,
+    are transcribed together, up to STT_BATCH_SIZE at once.
+    run_batch is an async callable that transcribes a list of utterances,
+    and concurrency is the number of batches that may run at once (one per model).
+    """
+
+    def __init__(self, run_batch, concurrency=1, batch_size=None, window=None):
+        self.run_batch = run_batch
+        self.slots = asyncio.Semaphore(concurrency)
+        self.batch_size = batch_size or STT_BATCH_SIZE
+        self.window = window if window is not None else STT_BATCH_WINDOW
+        self.queue = asyncio.Queue()
+        self.worker = None
+        self.tasks = set()
+        self.batches = 0
+        self.utterances = 0
+
+    async def transcribe(self, raw_pcm):
+        """
+        Queues an utterance and waits for its text.
+
+        Args:
+            raw_pcm: Raw PCM of the utterance. Must stay valid until this returns.
+
+        Returns:
+            The transcribed text.
+        """
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((time.monotonic(), raw_pcm, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            # Wait for a free model first, so utterances keep collecting while all are busy
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = batch[0][0] + self.window
+
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Utterances whose caller gave up are not transcribed
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                self.slots.release()
+                continue
+
+            task = asyncio.create_task(self._transcribe(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _transcribe(self, batch):
+        try:
+            texts = await self.run_batch([item[1] for item in batch])
+            for (_, _, future), text in zip(batch, texts):
+                if not future.done():
+                    future.set_result(text)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.slots.release()
+
+        self.batches += 1
+        self.utterances += len(batch)
+        if len(batch) > 1:
+            print(f"Transcribed a batch of {len(batch)} utterances ({self.utterances / self.batches:.2f} per batch on average)")
+
+
+def clean_transcript(text):
+    """
+    Lowercases a transcript and strips punctuation used by the trigger check.
+
+    Args:
+        text: The transcribed text.
+
+    Returns:
+        The cleaned text.
+    """
+    return text.lower().replace(",", "").replace(".", "").replace("?", "").replace("!", "").strip()
+
+
+def contains_trigger(clean_text, fuzzy=False):
+    """
+    Checks whether a cleaned transcript contains one of the TRIGGERS.
+
+    Args:
+        clean_text: Text returned by clean_transcript.
+        fuzzy: Also accept words that are close to a trigger. Used for the small
+            wake-word model, which misspells names more often than the full model.
+
+    Returns:
+        True if a trigger was found.
+    """
+    if any(trigger in clean_text for trigger in TRIGGERS):
+        return True
+    if not fuzzy:
+        return False
+    words = clean_text.split()
+    return any(difflib.get_close_matches(word, TRIGGERS, n=1, cutoff=0.75) for word in words)
+
+
+_wake_word_model = None
+
+
+def load_wake_word_model():
+    """
+    Loads the small CPU Whisper model used by the wake-word cascade.
+
+    Returns:
+        The shared wake-word WhisperModel instance.
+    """
+    global _wake_word_model
+
+    with _whisper_load_lock:
+        if _wake_word_model is not None:
+            return _wake_word_model
+
+        from faster_whisper import WhisperModel
+
+        print(f"Loading wake-word model '{WAKE_WORD_MODEL}' (cpu, int8)...")
+        model = WhisperModel(WAKE_WORD_MODEL, device="cpu", compute_type="int8", cpu_threads=WHISPER_CPU_THREADS)
+        warm_up_whisper(model)
+        _wake_word_model = model
+        return _wake_word_model
+
+
+class CascadeStats:
+    """
+    Counts how many utterances the wake-word stage rejected
+    and how much full transcription work that saved.
+    """
+
+    def __init__(self):
+        self.checked = 0
+        self.rejected = 0
+        self.rejected_seconds = 0.0
+        self.billed_seconds = 0.0
+
+    def record(self, passed, seconds):
+        """
+        Records the result of one wake-word check.
+
+        Args:
+            passed: Whether the utterance went on to full transcription.
+            seconds: Length of the whole utterance in seconds.
+        """
+        self.checked += 1
+        if not passed:
+            self.rejected += 1
+            self.rejected_seconds += seconds
+            self.billed_seconds += max(seconds, STT_MIN_BILLED_SECONDS)
+
+    def report(self):
+        """
+        Returns a one-line summary of the rejection rate and the savings.
+        """
+        rate = self.rejected / self.checked * 100 if self.checked else 0.0
+        summary = (f"Wake-word cascade: rejected {self.rejected}/{self.checked} ({rate:.0f}%), "
+                   f"saved {self.rejected} STT calls, {self.rejected_seconds:.0f}s of audio")
+        if not RUN_LOCALLY:
+            summary += f", ~${self.billed_seconds / 3600 * STT_COST_PER_HOUR:.4f}"
+        return summary
+
+
+cascade_stats = CascadeStats()
+
+
+def detect_wake_word(raw_pcm):
+    """
+    Cheap first stage of the trigger cascade: transcribes only the beginning
+    of the utterance with the small wake-word model and looks for a trigger.
+
+    Args:
+        raw_pcm: Raw PCM of the whole utterance (48 kHz stereo int16).
+
+    Returns:
+        A (passed, text) tuple.
+    """
+    model = _wake_word_model or load_wake_word_model()
+    head = memoryview(raw_pcm)[:int(WAKE_WORD_WINDOW * BYTES_PER_SECOND)]
+
+    segments, info = model.transcribe(
+        pcm_to_whisper_audio(head),
+        beam_size=1,
+        language=LANGUAGE.lower(),
+        # No initial prompt: it starts with the trigger name, which a small model
+        # readily repeats on silence or unclear speech, passing untriggered utterances
+        condition_on_previous_text=False,
+        without_timestamps=True
+    )
+    text = "".join(segment.text for segment in segments).strip()
+    passed = contains_trigger(clean_transcript(text), fuzzy=True)
+
+    cascade_stats.record(passed, len(raw_pcm) / BYTES_PER_SECOND)
+    return passed, text
@@ -0,0 +1,131 @@
+import sys
+import asyncio
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import *
+from audio import BYTES_PER_SECOND
+from stt import load_whisper_model, load_wake_word_model, transcribe_batch, detect_wake_word, cascade_stats
+
+
+def _init_worker():
+    # Runs once in every worker process, the models then stay loaded for its lifetime
+    load_whisper_model()
+    if REQUIRE_TRIGGER and WAKE_WORD_CASCADE:
+        load_wake_word_model()
+
+
+def _ping():
+    return True
+
+
+@contextmanager
+def _worker_main():
+    """
+    Spawned processes import the parent's __main__ again. While the workers start,
+    this module stands in for it, so they do not re-run main.py and build a second
+    bot, API clients, state store and scheduler each.
+    """
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = sys.modules[__name__]
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class STTWorkerPool:
+    """
+    Local Whisper transcription in separate worker processes, so CPU inference
+    never competes with the event loop and the voice receive thread for the GIL.
+    Each worker loads the models once; the wake-word check runs there as well.
+    PCM is sent over the worker pipe; unlike shared memory segments, nothing is
+    left behind when a worker dies mid-batch.
+    If a worker crashes, the pool is restarted and the call is retried once.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or STT_WORKERS
+        self.executor = None
+        self.restarts = 0
+
+    def start(self):
+        """
+        Spawns the worker processes and starts loading their models.
+
+        Returns:
+            The new ProcessPoolExecutor.
+        """
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+        # Every submit to a pool without an idle worker spawns one, so all of them are
+        # spawned here, while _worker_main is in place, instead of on the first utterances
+        with _worker_main():
+            for _ in range(self.workers):
+                executor.submit(_ping)
+        self.executor = executor
+        print(f"Started {self.workers} STT worker process(es)")
+        return executor
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        for _ in range(2):
+            executor = self.executor or self.start()
+            try:
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool as e:
+                print(f"STT Worker Error: {e}")
+                self.restart(executor)
+
+        raise RuntimeError("STT workers crashed twice in a row")
+
+    async def transcribe_batch(self, raw_pcms):
+        """
+        Transcribes a batch of utterances in a worker process.
+
+        Args:
+            raw_pcms: Raw PCM of each utterance (bytes, bytearray or memoryview).
+
+        Returns:
+            The transcribed texts in the same order.
+        """
+        return await self._call(transcribe_batch, [bytes(raw_pcm) for raw_pcm in raw_pcms])
+
+    async def detect_wake_word(self, raw_pcm):
+        """
+        Runs the wake-word check of the trigger cascade in a worker process.
+
+        Args:
+            raw_pcm: Raw PCM of the utterance, only its beginning is sent.
+
+        Returns:
+            A (passed, text) tuple.
+        """
+        head = bytes(memoryview(raw_pcm)[:int(WAKE_WORD_WINDOW * BYTES_PER_SECOND)])
+        passed, text = await self._call(detect_wake_word, head)
+        # The worker counts only the head, the savings are counted here for the whole utterance
+        cascade_stats.record(passed, len(raw_pcm) / BYTES_PER_SECOND)
+        return passed, text
+
+    def restart(self, broken):
+        """
+        Replaces a broken pool. Callers that failed on the same pool restart it only once.
+
+        Args:
+            broken: The executor that raised BrokenProcessPool.
+        """
+        if self.executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.restarts += 1
+        print(f"Restarting STT workers (restart #{self.restarts})")
+        self.start()
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,234 @@
+import re
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from config import *
+from clients import tavily_search
+from metrics import span
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after a fixed time.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Returns the cached (value, latency) pair or None if missing or expired.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires, value, latency = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return value, latency
+
+    def put(self, key, value, latency):
+        """
+        Stores a value together with the time it took to produce it.
+        """
+        self.entries[key] = (time.monotonic() + self.ttl, value, latency)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+def normalize_args(args):
+    """
+    Normalizes tool arguments for cache lookups, so "Weather in  Warsaw?" and
+    "weather in warsaw" share an entry.
+
+    Args:
+        args: Parsed tool arguments.
+
+    Returns:
+        A hashable cache key.
+    """
+    normalized = {}
+    for name, value in args.items():
+        if isinstance(value, str):
+            value = re.sub(r"[^\w\s]", "", value.lower())
+            value = " ".join(value.split())
+        normalized[name] = value
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+
+class ToolExecutor:
+    """
+    Runs the tool calls of one LLM response concurrently.
+    Results of cacheable tools are kept in a TTL cache, and identical calls
+    that are already running are merged into a single request.
+    """
+
+    def __init__(self):
+        self.tools = {}
+        self.schema = []
+        self.cache = TTLCache(TOOL_CACHE_SIZE, TOOL_CACHE_TTL)
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+
+    def register(self, name, description, parameters=None, cacheable=False):
+        """
+        Decorator that registers an async function as a tool and adds it to the schema.
+
+        Args:
+            name: Tool name exposed to the LLM.
+            description: Tool description for the LLM.
+            parameters: JSON schema properties of the arguments.
+            cacheable: Whether results may be served from the TTL cache.
+        """
+        parameters = parameters or {}
+
+        def decorator(func):
+            self.tools[name] = (func, cacheable)
+            self.schema.append({
+                "type": "function",
+                "function": {
+                    "name": name,
+                    "description": description,
+                    "parameters": {
+                        "type": "object",
+                        "properties": parameters,
+                        "required": list(parameters.keys()),
+                    },
+                }
+            })
+            return func
+
+        return decorator
+
+    async def run(self, tool_call):
+        """
+        Runs one tool call.
+
+        Args:
+            tool_call: Tool call dict in the API message format.
+
+        Returns:
+            The tool message to append to the conversation.
+        """
+        name = tool_call["function"]["name"]
+        try:
+            if name not in self.tools:
+                raise ValueError(f"Unknown tool: {name}")
+
+            func, cacheable = self.tools[name]
+            args = json.loads(tool_call["function"]["arguments"] or "{}")
+
+            with span(f"tool_{name}"):
+                if cacheable:
+                    content = await self._run_cached(name, func, args)
+                else:
+                    content = await func(**args)
+        except Exception as e:
+            print(f"Tool Error ({name}): {e}")
+            content = json.dumps({"error": str(e)})
+
+        return {
+            "tool_call_id": tool_call["id"],
+            "role": "tool",
+            "name": name,
+            "content": content,
+        }
+
+    async def _run_cached(self, name, func, args):
+        key = (name, normalize_args(args))
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            content, latency = cached
+            self.hits += 1
+            self.saved_latency += latency
+            return content
+
+        # The tool runs in its own task that callers only wait for, so a cancelled
+        # caller never leaves the merged ones without a result
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(key, func, args))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self._fetched(key, done))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, func, args):
+        start = time.perf_counter()
+        content = await func(**args)
+        self.cache.put(key, content, time.perf_counter() - start)
+        return content
+
+    def _fetched(self, key, task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        if not task.cancelled():
+            # Marks the exception retrieved when every caller was cancelled before it
+            task.exception()
+
+    async def run_all(self, tool_calls):
+        """
+        Runs all tool calls of one response concurrently.
+
+        Args:
+            tool_calls: List of tool call dicts.
+
+        Returns:
+            Tool messages in the same order as the calls.
+        """
+        results = await asyncio.gather(*(self.run(tool_call) for tool_call in tool_calls))
+        if self.hits + self.misses:
+            hit_rate = self.hits / (self.hits + self.misses) * 100
+            print(f"Tool cache: {self.hits}/{self.hits + self.misses} hits ({hit_rate:.0f}%), saved {self.saved_latency:.2f}s")
+        return list(results)
+
+
+tool_executor = ToolExecutor()
+tools_schema = tool_executor.schema
+
+
+@tool_executor.register(
+    "web_search",
+    "Get current information from the internet (weather, news, facts). Use this when the user asks about something that requires up-to-date knowledge.",
+    {
+        "query": {
+            "type": "string",
+            "description": "The search query to send to the search engine (e.g. 'current weather in Warsaw', 'who won the match yesterday')."
+        }
+    },
+    cacheable=True
+)
+async def web_search(query):
+    print(f"Searching: {query}")
+    raw_result = await tavily_search(query, search_depth="basic", max_tokens=500)
+    return json.dumps(raw_result, ensure_ascii=False)
+
+
+@tool_executor.register(
+    "current_time",
+    "Fetch the current date and time in the user's local time zone."
+)
+async def current_time():
+    print(f"Fetching current server time")
+    current_time_str = datetime.now(ZoneInfo(ZONE)).strftime("%Y-%m-%d %H:%M:%S")
+    raw_result = {
+        "status": "success",
+        "current_time": current_time_str,
+        "time_zone": ZONE
+    }
+    return json.dumps(raw_result, ensure_ascii=False)
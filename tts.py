@@ -0,0 +1,261 @@
+import re
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+import av
+import discord
+from config import *
+from audio import SAMPLE_RATE, FRAME_BYTES
+from metrics import record
+
+
+_SENTENCE_END = re.compile(r'(?<=[.!?…:;])\s+|\n+')
+
+
+class SentenceSplitter:
+    """
+    Collects streamed LLM text and cuts it into sentences,
+    so each sentence can be synthesized while the rest is still generating.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, delta):
+        """
+        Adds a piece of streamed text.
+
+        Args:
+            delta: New text from the LLM stream.
+
+        Returns:
+            A list of sentences completed by this piece.
+        """
+        self.buffer += delta
+        parts = _SENTENCE_END.split(self.buffer)
+        self.buffer = parts.pop()
+        return [part.strip() for part in parts if part.strip()]
+
+    def flush(self):
+        """
+        Returns the remaining text once the stream has ended.
+
+        Returns:
+            The last, unterminated sentence or an empty string.
+        """
+        rest = self.buffer.strip()
+        self.buffer = ""
+        return rest
+
+
+def clean_for_speech(text):
+    """
+    Removes markdown emphasis that would otherwise be read aloud.
+
+    Args:
+        text: Text produced by the LLM.
+
+    Returns:
+        The text without asterisks.
+    """
+    return text.replace("**", "").replace("*", "")
+
+
+class TTSAudioSource(discord.AudioSource):
+    """
+    Plays synthesized MP3 audio straight from memory.
+    MP3 chunks are decoded in-process as they arrive, so playback can start
+    on the first chunk while the rest of the sentence is still being received.
+    """
+
+    def __init__(self):
+        self.codec = av.CodecContext.create("mp3", "r")
+        self.resampler = av.AudioResampler(format="s16", layout="stereo", rate=SAMPLE_RATE)
+        self.buffer = bytearray()
+        self.condition = threading.Condition()
+        self.finished = False
+        self.closed = False
+        # Task streaming the audio from edge-tts, stopped when the source is cleaned up
+        self.pump_task = None
+
+    def feed(self, mp3_chunk):
+        """
+        Decodes a chunk of MP3 data and appends the PCM to the playback buffer.
+
+        Args:
+            mp3_chunk: MP3 bytes. An empty chunk flushes the parser.
+        """
+        for packet in self.codec.parse(mp3_chunk):
+            self._decode(packet)
+
+    def finish(self):
+        """
+        Flushes the decoder and marks the end of the audio.
+        """
+        try:
+            self.feed(b"")
+            self._decode(None)
+            self._append(self.resampler.resample(None))
+        except Exception as e:
+            print(f"TTS Decode Error: {e}")
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+
+    def _decode(self, packet):
+        try:
+            frames = self.codec.decode(packet)
+        except av.error.InvalidDataError:
+            # Tags and partial frames at chunk boundaries are skipped
+            return
+        for frame in frames:
+            self._append(self.resampler.resample(frame))
+
+    def _append(self, frames):
+        pcm = b"".join(frame.to_ndarray().tobytes() for frame in frames)
+        if not pcm:
+            return
+        with self.condition:
+            self.buffer.extend(pcm)
+            self.condition.notify_all()
+
+    def read(self):
+        with self.condition:
+            self.condition.wait_for(
+                lambda: len(self.buffer) >= FRAME_BYTES or self.finished or self.closed,
+                timeout=0.1
+            )
+            if self.closed or (self.finished and not self.buffer):
+                return b""
+
+            # The network is slower than playback, play silence instead of ending
+            if not self.buffer:
+                return bytes(FRAME_BYTES)
+
+            frame = bytes(self.buffer[:FRAME_BYTES])
+            del self.buffer[:FRAME_BYTES]
+
+        if len(frame) < FRAME_BYTES:
+            frame += bytes(FRAME_BYTES - len(frame))
+        return frame
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        """
+        Drops the audio and stops downloading the rest of it. Called on the event loop,
+        or by discord's player thread when playback ends or is stopped.
+        """
+        with self.condition:
+            self.closed = True
+            self.buffer.clear()
+            self.condition.notify_all()
+        task = self.pump_task
+        if task and not task.done():
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+
+_tts_cache = OrderedDict()
+
+
+def _cache_get(key):
+    audio = _tts_cache.get(key)
+    if audio is not None:
+        _tts_cache.move_to_end(key)
+    return audio
+
+
+def _cache_put(key, audio):
+    _tts_cache[key] = audio
+    _tts_cache.move_to_end(key)
+    while len(_tts_cache) > TTS_CACHE_SIZE:
+        _tts_cache.popitem(last=False)
+
+
+async def synthesize(text):
+    """
+    Synthesizes text with edge-tts into an in-memory audio source.
+    Returns as soon as the first audio chunk is decoded, the rest keeps streaming
+    in the background. Finished phrases are kept in an LRU cache, so repeated
+    phrases (greetings, error messages) are played without a network round trip.
+
+    Args:
+        text: The text to speak.
+
+    Returns:
+        A TTSAudioSource ready for vc.play.
+    """
+    source = TTSAudioSource()
+    key = (TTS_VOICE, text)
+
+    cached = _cache_get(key)
+    if cached is not None:
+        source.feed(cached)
+        source.finish()
+        return source
+
+    first_chunk = asyncio.Event()
+    start = time.monotonic()
+
+    async def pump():
+        chunks = []
+        try:
+            # Imported on first use, it is only needed once the bot speaks
+            import edge_tts
+            communicate = edge_tts.Communicate(text, TTS_VOICE)
+            async for chunk in communicate.stream():
+                if source.closed:
+                    return
+                if chunk["type"] == "audio":
+                    if not chunks:
+                        record("tts_first_chunk", time.monotonic() - start)
+                    chunks.append(chunk["data"])
+                    source.feed(chunk["data"])
+                    first_chunk.set()
+            if chunks:
+                _cache_put(key, b"".join(chunks))
+        except Exception as e:
+            print(f"TTS Error: {e}")
+        finally:
+            source.finish()
+            first_chunk.set()
+
+    source.pump_task = asyncio.create_task(pump())
+    try:
+        await first_chunk.wait()
+    except asyncio.CancelledError:
+        source.cleanup()
+        raise
+    return source
+
+
+def discard_synthesis(synth_task):
+    """
+    Drops a synthesis that will not be played: cancels it if it is still starting,
+    or cleans up its source, which stops the download of the rest of the audio.
+
+    Args:
+        synth_task: The asyncio Task running synthesize.
+    """
+    if not synth_task.done():
+        synth_task.cancel()
+    elif not synth_task.cancelled() and synth_task.exception() is None:
+        synth_task.result().cleanup()
+
+
+async def warm_up_tts(text=None):
+    """
+    Synthesizes a phrase in the background at startup, so the first reply
+    does not pay for importing and connecting, and the phrase is cached.
+
+    Args:
+        text: The phrase, TTS_WARM_UP_PHRASE by default.
+    """
+    start = time.monotonic()
+    source = await synthesize(text or TTS_WARM_UP_PHRASE)
+    while not source.finished:
+        await asyncio.sleep(0.05)
+    source.cleanup()
+    print(f"TTS warm-up finished in {time.monotonic() - start:.2f}s")